@@ -1,321 +1,617 @@
-from flask import Flask, request, jsonify, Response
+import time
+# Measured from the first import so startup cost can be tracked (see /health)
+STARTUP_BEGAN = time.perf_counter()
+
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context, g, has_request_context
+import argparse
+import copy
 import json
 import os
+import sqlite3
+import uuid
 import base64
+import hashlib
 import io
 import logging
+import math
+import atexit
+import queue
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
 import traceback
+import zipfile
+import multiprocessing
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from functools import lru_cache, wraps
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from jinja2 import Template
 import qrcode
+from qrcode.image.svg import SvgPathImage
 from PIL import Image
 import weasyprint
+from weasyprint.text.fonts import FontConfiguration
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+# Metrics from every gunicorn worker (and batch process) are aggregated through this
+# shared directory; it must be set before prometheus_client is imported. gunicorn.conf.py
+# provides one cleared per deployment; flask run, the test client and the CLI get a fresh
+# directory for this run (inherited by its batch processes) that is removed at exit
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='invoice-service-metrics-')
+    atexit.register(shutil.rmtree, os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+from prometheus_client import CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+# Configure logging: records are filtered and sampled on the calling thread, then
+# encoded as JSON and written to stderr by a background listener thread
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Fraction of success-path records kept per level; warnings and errors are never sampled
+LOG_SAMPLE_RATES = {
+    logging.DEBUG: float(os.getenv('LOG_SAMPLE_DEBUG', '1.0')),
+    logging.INFO: float(os.getenv('LOG_SAMPLE_INFO', '1.0')),
+}
+
+class SamplingFilter(logging.Filter):
+    """Keep a configurable fraction of DEBUG/INFO records"""
+    def filter(self, record):
+        rate = LOG_SAMPLE_RATES.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class StructuredQueueHandler(QueueHandler):
+    """Queue records with their message and traceback resolved, leaving JSON encoding to the listener"""
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as a single-line JSON object, including any extra fields"""
+    STANDARD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message'}
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'msg': record.getMessage()
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.STANDARD_FIELDS)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+_log_listener = None
+
+def setup_logging():
+    """Route all logging through a queue drained by a background JSON writer thread"""
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    _log_listener = QueueListener(log_queue, stream_handler)
+    _log_listener.start()
+
+def stop_logging():
+    """Flush queued records on interpreter exit"""
+    if _log_listener is not None:
+        _log_listener.stop()
+
+setup_logging()
+atexit.register(stop_logging)
+# The listener thread does not survive a fork (gunicorn workers), so start a fresh one
+os.register_at_fork(after_in_child=setup_logging)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Updated HTML template for Invoice (same as before)
-INVOICE_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{{ invoice_type | default("Invoice Template") }}</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
+# Render pipeline metrics, exposed on /metrics
+REQUEST_COUNT = Counter(
+    'invoice_requests_total', 'Requests by endpoint, output format and status code',
+    ['endpoint', 'format', 'status']
+)
+STAGE_SECONDS = Histogram(
+    'invoice_stage_seconds', 'Time spent in each render pipeline stage', ['stage'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+PDF_BYTES = Histogram(
+    'invoice_pdf_bytes', 'Size of generated PDFs',
+    buckets=(10e3, 25e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6)
+)
+HTML_FALLBACKS = Counter('invoice_html_fallbacks_total', 'PDF failures answered with the HTML fallback', ['endpoint'])
+CACHE_LOOKUPS = Counter('invoice_render_cache_lookups_total', 'Render cache lookups by result', ['result'])
+ADMISSION_REJECTIONS = Counter('invoice_admission_rejections_total', 'Renders refused by admission control', ['reason'])
+SLOT_WAIT_SECONDS = Histogram(
+    'invoice_slot_wait_seconds', 'Time renders waited for a scheduler slot', ['lane'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
 
-        body {
-            font-family: Arial, sans-serif;
-            font-size: 10px;
-            line-height: 1.2;
-            color: #000;
-        }
+# Add per-stage timings to JSON error bodies (also available per request with ?timing=1)
+TIMING_IN_ERRORS = os.getenv('TIMING_IN_ERRORS', 'false').lower() in ('1', 'true', 'yes')
 
-        .invoice-container {
-            width: 210mm;
-            min-height: 297mm;
-            margin: 0 auto;
-            padding: 10mm;
-            background: white;
-        }
+@contextmanager
+def observe_stage(stage):
+    """Record how long the wrapped block takes in the per-stage histogram
 
-        .header-section {
-            border: 1px solid #000;
-            margin-bottom: 5px;
-        }
+    Inside a request the duration is also kept for the Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(duration)
+        if has_request_context():
+            timings = g.setdefault('stage_timings', {})
+            timings[stage] = timings.get(stage, 0.0) + duration
 
-        .company-info {
-            display: flex;
-            justify-content: space-between;
-            padding: 5px;
-            border-bottom: 1px solid #000;
-        }
+# Batch rendering configuration. Every gunicorn worker (WEB_CONCURRENCY) starts its own pool,
+# so by default the host's CPUs are split between them rather than given to each
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', max(1, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY))))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '1000'))
+# Renders in flight while streaming a format=zip batch; bounds memory to about this many PDFs
+ZIP_WINDOW = int(os.getenv('ZIP_WINDOW', str(BATCH_WORKERS * 2)))
+# Batch processes are replaced after this many renders so leaked layout memory is returned (0 = never)
+BATCH_MAX_TASKS_PER_CHILD = int(os.getenv('BATCH_MAX_TASKS_PER_CHILD', '100'))
 
-        .company-left {
-            flex: 1;
-        }
+# Memory governor: a worker whose RSS passes the ceiling is recycled after its current request,
+# and PDF renders estimated (from their product count) to need more than the budget are refused.
+# The ceiling splits most of the instance's memory between the gunicorn workers, leaving the
+# rest to the master and the batch pool
+MEMORY_INSTANCE_MB = int(os.getenv('MEMORY_INSTANCE_MB', '512'))
+MEMORY_CEILING_MB = int(os.getenv('MEMORY_CEILING_MB', str(int(MEMORY_INSTANCE_MB * 0.75) // max(1, WEB_CONCURRENCY))))
+MEMORY_RENDER_BUDGET_MB = int(os.getenv('MEMORY_RENDER_BUDGET_MB', str(MEMORY_CEILING_MB // 2)))
+# A render pays the stylesheet and fonts once, then each document and product row adds to it
+RENDER_BASE_MB = float(os.getenv('RENDER_BASE_MB', '15'))
+RENDER_MB_PER_DOCUMENT = float(os.getenv('RENDER_MB_PER_DOCUMENT', '1'))
+RENDER_MB_PER_PRODUCT = float(os.getenv('RENDER_MB_PER_PRODUCT', '0.2'))
 
-        .company-right {
-            flex: 1;
-            text-align: right;
-        }
+# Render scheduler: every PDF render takes one of SCHEDULER_SLOTS host-wide slots (about one per
+# core, and never fewer than two) in the interactive lane (single documents) or the bulk lane
+# (batches and async jobs)
+SCHEDULER_DB_PATH = os.getenv('SCHEDULER_DB_PATH', os.path.join(tempfile.gettempdir(), 'invoice-service-scheduler.sqlite3'))
+SCHEDULER_SLOTS = int(os.getenv('SCHEDULER_SLOTS', max(os.cpu_count() or 1, 2)))
+# Slots the bulk lane never takes, so a single invoice need not wait behind a batch; must be below SCHEDULER_SLOTS
+INTERACTIVE_RESERVED_SLOTS = int(os.getenv('INTERACTIVE_RESERVED_SLOTS', '1'))
+# Relative share of the slots each lane gets while both have renders waiting
+INTERACTIVE_WEIGHT = float(os.getenv('INTERACTIVE_WEIGHT', '3'))
+BULK_WEIGHT = float(os.getenv('BULK_WEIGHT', '1'))
+# First pause between a waiting render's polls; it doubles up to RenderScheduler.MAX_POLL_INTERVAL
+SCHEDULER_POLL_INTERVAL = float(os.getenv('SCHEDULER_POLL_INTERVAL', '0.02'))
+# Longest a batch item or async job waits for a bulk slot before its batch is refused (503) or the job requeued
+BULK_SLOT_TIMEOUT = float(os.getenv('BULK_SLOT_TIMEOUT', '60'))
 
-        .invoice-header {
-            text-align: center;
-            background: #f0f0f0;
-            padding: 5px;
-            font-weight: bold;
-            font-size: 14px;
-            border-bottom: 1px solid #000;
-            color: #d63384;
-        }
+# Admission control: synchronous PDF renders are costed in CPU seconds and refused up front
+# (429/503 with Retry-After) when they could not finish before ADMISSION_DEADLINE
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Kept below gunicorn's 120s worker timeout so an admitted render is never killed mid-flight
+ADMISSION_DEADLINE = float(os.getenv('ADMISSION_DEADLINE', '90'))
+# Shed load (429) once the work queued ahead in a request's lane needs this many seconds to drain
+ADMISSION_MAX_BACKLOG = float(os.getenv('ADMISSION_MAX_BACKLOG', '30'))
+RENDER_COST_BASE = float(os.getenv('RENDER_COST_BASE', '0.3'))
+RENDER_COST_PER_PRODUCT = float(os.getenv('RENDER_COST_PER_PRODUCT', '0.015'))
+RENDER_COST_EINVOICE = float(os.getenv('RENDER_COST_EINVOICE', '0.05'))
+RENDER_COST_EWAYBILL = float(os.getenv('RENDER_COST_EWAYBILL', '0.05'))
 
-        /* E-Invoice and E-Way Bill specific styles */
-        .einvoice-info, .ewaybill-info {
-            background: #e7f3ff;
-            border: 1px solid #0066cc;
-            padding: 10px;
-            margin: 10px 0;
-            border-radius: 5px;
-        }
+# Render cache configuration (CACHE_MAX_BYTES=0 disables the memory tier, CACHE_DIR='' the disk tier)
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'invoice-service-cache'))
+CACHE_DISK_TTL = int(os.getenv('CACHE_DISK_TTL', str(24 * 60 * 60)))
 
-        .ewaybill-info {
-            background: #fff3e0;
-            border-color: #ff9800;
-        }
+# Async render job configuration
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', os.path.join(tempfile.gettempdir(), 'invoice-service-jobs.sqlite3'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '600'))
+# A stale job is handed out at most this many times before it is failed, so a payload
+# that crashes its worker is not retried forever
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', str(24 * 60 * 60)))
 
-        .irn-section, .ewb-section {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 10px;
-        }
+# Idempotent render requests: retries with the same Idempotency-Key wait for the first attempt
+# and get its response replayed for IDEMPOTENCY_TTL seconds
+IDEMPOTENCY_DB_PATH = os.getenv('IDEMPOTENCY_DB_PATH', os.path.join(tempfile.gettempdir(), 'invoice-service-idempotency.sqlite3'))
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '600'))
+# Opt-in: also treat requests without the header as retries when their invoice_number repeats
+IDEMPOTENCY_INVOICE_FALLBACK = os.getenv('IDEMPOTENCY_INVOICE_FALLBACK', 'false').lower() in ('1', 'true', 'yes')
+# Longest a duplicate waits (holding a thread, but no render slot) before it gets 409 with Retry-After
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', '15'))
+# A claim older than this belongs to a worker that died, and is taken over
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '150'))
 
-        .irn-details, .ewb-details {
-            flex: 2;
-        }
+# QR code configuration (payload field qr_format overrides the server default: png or svg)
+QR_FORMAT = os.getenv('QR_FORMAT', 'png').lower()
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '1024'))
 
-        .qr-code-section {
-            flex: 1;
-            text-align: center;
-        }
+# Registered company profiles (see /company-profiles)
+PROFILE_DB_PATH = os.getenv('PROFILE_DB_PATH', os.path.join(tempfile.gettempdir(), 'invoice-service-profiles.sqlite3'))
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '256'))
 
-        .qr-code-image {
-            max-width: 120px;
-            max-height: 120px;
-            border: 1px solid #ccc;
-        }
+# Local asset store for logos and signatures, referenced from templates as asset:<name>.
+# Images are scaled down to ASSET_MAX_PX once and kept in a bounded in-memory cache
+ASSET_DIR = os.getenv('ASSET_DIR', os.path.join(tempfile.gettempdir(), 'invoice-service-assets'))
+ASSET_CACHE_BYTES = int(os.getenv('ASSET_CACHE_BYTES', str(16 * 1024 * 1024)))
+ASSET_MAX_PX = int(os.getenv('ASSET_MAX_PX', '600'))
+ASSET_MAX_UPLOAD_BYTES = int(os.getenv('ASSET_MAX_UPLOAD_BYTES', str(2 * 1024 * 1024)))
+# Decoded images WeasyPrint keeps between renders before the cache is started afresh
+IMAGE_CACHE_ENTRIES = int(os.getenv('IMAGE_CACHE_ENTRIES', '256'))
 
-        .compliance-note {
-            font-size: 8px;
-            color: #666;
-            font-style: italic;
-            margin-top: 5px;
-        }
+# WeasyPrint output options per PDF profile (payload field pdf_profile overrides the server default).
+# Fonts are subset and streams compressed in every profile unless the profile says otherwise
+PDF_PROFILES = {
+    'standard': {},
+    'compact': {'optimize_images': True, 'jpeg_quality': 60, 'dpi': 150},
+    'print': {'full_fonts': True, 'hinting': True, 'dpi': 300}
+}
+PDF_PROFILE = os.getenv('PDF_PROFILE', 'standard').lower()
+# PDF version written by every profile ('' keeps WeasyPrint's default)
+PDF_VERSION = os.getenv('PDF_VERSION', '')
 
-        .transport-details {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 10px;
-            margin-top: 10px;
-        }
+# Product rows per table fragment when an invoice asks for paginate=true. The first page
+# shares its height with the seller, buyer and e-invoice header, so it holds fewer rows
+ROWS_PER_PAGE = int(os.getenv('ROWS_PER_PAGE', '30'))
+FIRST_PAGE_ROWS = int(os.getenv('FIRST_PAGE_ROWS', '15'))
 
-        .transport-section {
-            padding: 8px;
-            background: #f8f9fa;
-            border: 1px solid #dee2e6;
-            border-radius: 4px;
-        }
+# Template fragments buffered per chunk when streaming HTML
+STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', '64'))
 
-        .transport-title {
-            font-weight: bold;
-            color: #495057;
-            margin-bottom: 5px;
-        }
+# Invoice stylesheet, kept separate so PDF renders can reuse one parsed copy
+INVOICE_CSS = """
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
 
-        .transport-row {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 2px;
-            font-size: 8px;
-        }
+body {
+    font-family: Arial, sans-serif;
+    font-size: 10px;
+    line-height: 1.2;
+    color: #000;
+}
 
-        .status-generated {
-            background: #d4edda;
-            color: #155724;
-        }
+.invoice-container {
+    width: 210mm;
+    min-height: 297mm;
+    margin: 0 auto;
+    padding: 10mm;
+    background: white;
+}
 
-        .status-pending {
-            background: #fff3cd;
-            color: #856404;
-        }
+.header-section {
+    border: 1px solid #000;
+    margin-bottom: 5px;
+}
 
-        .status-failed {
-            background: #f8d7da;
-            color: #721c24;
-        }
+.company-info {
+    display: flex;
+    justify-content: space-between;
+    padding: 5px;
+    border-bottom: 1px solid #000;
+}
 
-        .ewaybill-status {
-            display: inline-block;
-            padding: 3px 8px;
-            border-radius: 3px;
-            font-size: 8px;
-            font-weight: bold;
-        }
+.company-left {
+    flex: 1;
+}
 
-        /* Rest of existing styles remain the same */
-        .billing-section {
-            display: flex;
-            padding: 5px;
-        }
+.company-logo {
+    max-height: 40px;
+    max-width: 160px;
+}
 
-        .from-section, .to-section {
-            flex: 1;
-            padding: 0 10px;
-        }
+.company-right {
+    flex: 1;
+    text-align: right;
+}
 
-        .from-section {
-            border-right: 1px solid #000;
-        }
+.invoice-header {
+    text-align: center;
+    background: #f0f0f0;
+    padding: 5px;
+    font-weight: bold;
+    font-size: 14px;
+    border-bottom: 1px solid #000;
+    color: #d63384;
+}
 
-        .section-title {
-            font-weight: bold;
-            margin-bottom: 5px;
-        }
+/* E-Invoice and E-Way Bill specific styles */
+.einvoice-info, .ewaybill-info {
+    background: #e7f3ff;
+    border: 1px solid #0066cc;
+    padding: 10px;
+    margin: 10px 0;
+    border-radius: 5px;
+}
 
-        .info-row {
-            margin-bottom: 2px;
-            display: flex;
-        }
+.ewaybill-info {
+    background: #fff3e0;
+    border-color: #ff9800;
+}
 
-        .info-label {
-            font-weight: bold;
-            min-width: 80px;
-        }
+.irn-section, .ewb-section {
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+    margin-bottom: 10px;
+}
 
-        .products-table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 10px 0;
-            font-size: 8px;
-        }
+.irn-details, .ewb-details {
+    flex: 2;
+}
 
-        .products-table th,
-        .products-table td {
-            border: 1px solid #000;
-            padding: 3px;
-            text-align: center;
-            vertical-align: top;
-        }
+.qr-code-section {
+    flex: 1;
+    text-align: center;
+}
 
-        .products-table th {
-            background: #f0f0f0;
-            font-weight: bold;
-            font-size: 7px;
-        }
+.qr-code-image {
+    max-width: 120px;
+    max-height: 120px;
+    border: 1px solid #ccc;
+}
 
-        .product-name {
-            text-align: left !important;
-            font-size: 7px;
-        }
+.qr-code-svg {
+    display: inline-block;
+    width: 120px;
+    height: 120px;
+}
 
-        .total-row {
-            font-weight: bold;
-            background: #f9f9f9;
-        }
+.qr-code-svg svg {
+    width: 100%;
+    height: 100%;
+}
 
-        .tax-summary {
-            margin: 10px 0;
-            border: 1px solid #000;
-        }
+.compliance-note {
+    font-size: 8px;
+    color: #666;
+    font-style: italic;
+    margin-top: 5px;
+}
 
-        .tax-header {
-            background: #f0f0f0;
-            padding: 5px;
-            font-weight: bold;
-            text-align: center;
-        }
+.transport-details {
+    display: grid;
+    grid-template-columns: 1fr 1fr;
+    gap: 10px;
+    margin-top: 10px;
+}
 
-        .tax-details {
-            display: flex;
-        }
+.transport-section {
+    padding: 8px;
+    background: #f8f9fa;
+    border: 1px solid #dee2e6;
+    border-radius: 4px;
+}
 
-        .tax-left {
-            flex: 2;
-            padding: 5px;
-            border-right: 1px solid #000;
-        }
+.transport-title {
+    font-weight: bold;
+    color: #495057;
+    margin-bottom: 5px;
+}
 
-        .tax-right {
-            flex: 1;
-            padding: 5px;
-        }
+.transport-row {
+    display: flex;
+    justify-content: space-between;
+    margin-bottom: 2px;
+    font-size: 8px;
+}
 
-        .tax-row {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 2px;
-        }
+.status-generated {
+    background: #d4edda;
+    color: #155724;
+}
 
-        .amount-words {
-            margin: 10px 0;
-            padding: 5px;
-            border: 1px solid #000;
-        }
+.status-pending {
+    background: #fff3cd;
+    color: #856404;
+}
 
-        .footer-section {
-            margin-top: 20px;
-            border-top: 1px solid #000;
-            padding-top: 10px;
-        }
+.status-failed {
+    background: #f8d7da;
+    color: #721c24;
+}
 
-        .footer-info {
-            font-size: 9px;
-            margin-bottom: 5px;
-        }
+.ewaybill-status {
+    display: inline-block;
+    padding: 3px 8px;
+    border-radius: 3px;
+    font-size: 8px;
+    font-weight: bold;
+}
 
-        .signature-section {
-            text-align: right;
-            margin-top: 20px;
-        }
+/* Rest of existing styles remain the same */
+.billing-section {
+    display: flex;
+    padding: 5px;
+}
 
-        .net-receivable {
-            font-weight: bold;
-            font-size: 12px;
-        }
+.from-section, .to-section {
+    flex: 1;
+    padding: 0 10px;
+}
 
-        @media print {
-            .invoice-container {
-                width: 100%;
-                margin: 0;
-                padding: 5mm;
-            }
-        }
+.from-section {
+    border-right: 1px solid #000;
+}
 
-        @page {
-            size: A4;
-            margin: 0.3in;
-        }
+.section-title {
+    font-weight: bold;
+    margin-bottom: 5px;
+}
+
+.info-row {
+    margin-bottom: 2px;
+    display: flex;
+}
+
+.info-label {
+    font-weight: bold;
+    min-width: 80px;
+}
+
+.products-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin: 10px 0;
+    font-size: 8px;
+}
+
+.products-table th,
+.products-table td {
+    border: 1px solid #000;
+    padding: 3px;
+    text-align: center;
+    vertical-align: top;
+}
+
+.products-table th {
+    background: #f0f0f0;
+    font-weight: bold;
+    font-size: 7px;
+}
+
+.product-name {
+    text-align: left !important;
+    font-size: 7px;
+}
+
+.total-row {
+    font-weight: bold;
+    background: #f9f9f9;
+}
+
+.subtotal-row {
+    font-style: italic;
+    background: #f9f9f9;
+}
+
+.products-page-break {
+    page-break-before: always;
+}
+
+.tax-summary {
+    margin: 10px 0;
+    border: 1px solid #000;
+}
+
+.tax-header {
+    background: #f0f0f0;
+    padding: 5px;
+    font-weight: bold;
+    text-align: center;
+}
+
+.tax-details {
+    display: flex;
+}
+
+.tax-left {
+    flex: 2;
+    padding: 5px;
+    border-right: 1px solid #000;
+}
+
+.tax-right {
+    flex: 1;
+    padding: 5px;
+}
+
+.tax-row {
+    display: flex;
+    justify-content: space-between;
+    margin-bottom: 2px;
+}
+
+.amount-words {
+    margin: 10px 0;
+    padding: 5px;
+    border: 1px solid #000;
+}
+
+.footer-section {
+    margin-top: 20px;
+    border-top: 1px solid #000;
+    padding-top: 10px;
+}
+
+.footer-info {
+    font-size: 9px;
+    margin-bottom: 5px;
+}
+
+.signature-section {
+    text-align: right;
+    margin-top: 20px;
+}
+
+.signature-image {
+    display: block;
+    margin-left: auto;
+    max-height: 40px;
+    max-width: 140px;
+}
+
+.net-receivable {
+    font-weight: bold;
+    font-size: 12px;
+}
+
+@media print {
+    .invoice-container {
+        width: 100%;
+        margin: 0;
+        padding: 5mm;
+    }
+}
+
+@page {
+    size: A4;
+    margin: 0.3in;
+}
+"""
+
+# Updated HTML template for Invoice (same as before)
+INVOICE_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ invoice_type | default("Invoice Template") }}</title>
+    {% if invoice_css %}
+    <style>
+{{ invoice_css }}
     </style>
+    {% else %}
+    <!-- invoice-css -->
+    {% endif %}
 </head>
 <body>
     <div class="invoice-container">
         <!-- Header Section -->
         <div class="header-section">
             <div class="company-info">
-                <div class="company-left">
-                    <div><strong>From:</strong> {{ company_name }}</div>
-                    <div>{{ company_address }}</div>
-                    <div>{{ company_city }}</div>
-                </div>
+                {{ company_fragments.header }}
                 <div class="company-right">
                     <div><strong>Inv No:</strong> {{ invoice_number }}</div>
                     <div><strong>Invoice Date:</strong> {{ invoice_date }}</div>
@@ -351,11 +647,15 @@ INVOICE_TEMPLATE = """
                         </div>
                         {% endif %}
                     </div>
-                    {% if show_qr_code and qr_code_base64 %}
+                    {% if show_qr_code and (qr_code_svg or qr_code_base64) %}
                     <div class="qr-code-section">
+                        {% if qr_code_svg %}
+                        <div class="qr-code-image qr-code-svg">{{ qr_code_svg }}</div>
+                        {% else %}
                         <img src="data:image/png;base64,{{ qr_code_base64 }}" 
                              alt="E-Invoice QR Code" 
                              class="qr-code-image" />
+                        {% endif %}
                         <div style="font-size: 7px; margin-top: 2px;">Scan QR for verification</div>
                     </div>
                     {% endif %}
@@ -485,18 +785,7 @@ INVOICE_TEMPLATE = """
                         <span class="info-label">SM MobNo:</span>
                         <span>{{ sm_mobile }}</span>
                     </div>
-                    <div class="info-row">
-                        <span class="info-label">PAN:</span>
-                        <span>{{ company_pan }}</span>
-                    </div>
-                    <div class="info-row">
-                        <span class="label">FSSAI Lic No:</span>
-                        <span>{{ company_fssai }}</span>
-                    </div>
-                    <div class="info-row">
-                        <span class="info-label">GST State:</span>
-                        <span>{{ company_gst_state }}, State Code: {{ company_state_code }}</span>
-                    </div>
+                    {{ company_fragments.details }}
                 </div>
                 
                 <div class="to-section">
@@ -547,8 +836,8 @@ INVOICE_TEMPLATE = """
             </div>
         </div>
 
-        <!-- Products Table -->
-        <table class="products-table">
+        <!-- Products Table (one fragment per page in paginated mode) -->
+        {% macro products_head() %}
             <thead>
                 <tr>
                     <th rowspan="2">S.</th>
@@ -577,8 +866,34 @@ INVOICE_TEMPLATE = """
                     <th>Amt</th>
                 </tr>
             </thead>
+        {% endmacro %}
+        {% macro subtotal_row(label, sums) %}
+                <tr class="subtotal-row">
+                    <td colspan="4"><strong>{{ label }}</strong></td>
+                    <td>{{ sums.cs }}</td>
+                    <td>{{ sums.qty }}</td>
+                    <td>{{ sums.free }}</td>
+                    <td></td>
+                    <td></td>
+                    <td>{{ sums.total }}</td>
+                    <td>{{ sums.pri_disc }}</td>
+                    <td>{{ sums.sec_disc }}</td>
+                    <td>{{ sums.lnd_disc }}</td>
+                    <td>{{ sums.taxable_amt }}</td>
+                    <td></td>
+                    <td>{{ sums.cgst_amt }}</td>
+                    <td></td>
+                    <td>{{ sums.sgst_amt }}</td>
+                    <td></td>
+                    <td>{{ sums.net_value }}</td>
+                </tr>
+        {% endmacro %}
+        {% for page in product_pages or [{'products': products}] %}
+        <table class="products-table{% if not loop.first %} products-page-break{% endif %}">
+            {{ products_head() }}
             <tbody>
-                {% for product in products %}
+                {% if page.brought_forward %}{{ subtotal_row('Brought forward', page.brought_forward) }}{% endif %}
+                {% for product in page.products %}
                 <tr>
                     <td>{{ product.serial_no }}</td>
                     <td>{{ product.hsn_code }}</td>
@@ -602,7 +917,9 @@ INVOICE_TEMPLATE = """
                     <td>{{ product.net_value }}</td>
                 </tr>
                 {% endfor %}
+                {% if page.carried_forward %}{{ subtotal_row('Carried forward', page.carried_forward) }}{% endif %}
                 
+                {% if loop.last %}
                 <tr class="total-row">
                     <td colspan="4"><strong>No.of Items sold: {{ total_items }}</strong></td>
                     <td><strong>{{ total_cs }}</strong></td>
@@ -622,8 +939,10 @@ INVOICE_TEMPLATE = """
                     <td></td>
                     <td><strong>{{ grand_total }}</strong></td>
                 </tr>
+                {% endif %}
             </tbody>
         </table>
+        {% endfor %}
 
         <!-- Tax Summary -->
         <div class="tax-summary">
@@ -687,198 +1006,2533 @@ INVOICE_TEMPLATE = """
 
         <!-- Footer -->
         <div class="footer-section">
-            <div class="footer-info">
-                <strong>For: {{ company_name }}</strong>
-            </div>
+            {{ company_fragments.signoff }}
             
             <div class="footer-info">
                 E. & O.E. Declaration: Whether the tax is payable on reverse charge basis: {{ reverse_charge_basis }}
             </div>
             
-            <div class="footer-info">
-                Kindly note, any product of {{ return_policy_note }}
-            </div>
-            
-            <div class="footer-info">
-                Subject to {{ jurisdiction }} Jurisdiction only <strong>Ac No. {{ bank_account_no }} - {{ bank_name }} - IFSC CODE {{ bank_ifsc }}</strong>
-            </div>
+            {{ company_fragments.terms }}
             
-            <div class="signature-section">
-                <strong>Authorised Signature</strong>
-            </div>
+            {{ company_fragments.signature }}
         </div>
     </div>
 </body>
 </html>
 """
 
-class InvoiceGenerator:
-    def __init__(self):
-        self.template = Template(INVOICE_TEMPLATE)
-    
-    def generate_qr_code(self, qr_data):
-        """Generate QR code image and return base64 encoded string"""
-        try:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=4,
-                border=1,
-            )
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-            
-            # Create QR code image
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convert to base64
-            buffered = io.BytesIO()
-            qr_img.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
-            
-            return img_base64
-        except Exception as e:
-            logger.error(f"Error generating QR code: {str(e)}")
-            return None
-    
-    def generate_html(self, invoice_data):
-        """Generate HTML invoice from JSON data with QR code support"""
-        try:
-            # Generate QR code if data is provided
-            if invoice_data.get('show_qr_code') and invoice_data.get('qr_code_data'):
-                qr_base64 = self.generate_qr_code(invoice_data['qr_code_data'])
-                if qr_base64:
-                    invoice_data['qr_code_base64'] = qr_base64
-                else:
-                    invoice_data['show_qr_code'] = False
+# Seller blocks of the invoice, rendered into INVOICE_TEMPLATE as company_fragments.
+# A registered company profile renders them once when saved, inline company fields per request
+COMPANY_FRAGMENT_TEMPLATES = {
+    'header': """<div class="company-left">
+                    {% if company_logo %}
+                    <img class="company-logo" src="asset:{{ company_logo }}" alt="">
+                    {% endif %}
+                    <div><strong>From:</strong> {{ company_name }}</div>
+                    <div>{{ company_address }}</div>
+                    <div>{{ company_city }}</div>
+                </div>""",
+    'details': """<div class="info-row">
+                        <span class="info-label">PAN:</span>
+                        <span>{{ company_pan }}</span>
+                    </div>
+                    <div class="info-row">
+                        <span class="label">FSSAI Lic No:</span>
+                        <span>{{ company_fssai }}</span>
+                    </div>
+                    <div class="info-row">
+                        <span class="info-label">GST State:</span>
+                        <span>{{ company_gst_state }}, State Code: {{ company_state_code }}</span>
+                    </div>""",
+    'signoff': """<div class="footer-info">
+                <strong>For: {{ company_name }}</strong>
+            </div>""",
+    'terms': """<div class="footer-info">
+                Kindly note, any product of {{ return_policy_note }}
+            </div>
             
-            html_content = self.template.render(**invoice_data)
-            return html_content
-        except Exception as e:
-            logger.error(f"Error generating HTML: {str(e)}")
-            raise Exception(f"Error generating HTML: {str(e)}")
+            <div class="footer-info">
+                Subject to {{ jurisdiction }} Jurisdiction only <strong>Ac No. {{ bank_account_no }} - {{ bank_name }} - IFSC CODE {{ bank_ifsc }}</strong>
+            </div>""",
+    'signature': """<div class="signature-section">
+                {% if signature_image %}
+                <img class="signature-image" src="asset:{{ signature_image }}" alt="">
+                {% endif %}
+                <strong>Authorised Signature</strong>
+            </div>"""
+}
+
+# Documented payload fields, served by /template-schema and used to compile the validators
+TEMPLATE_SCHEMA = {
+    "invoice_number": "string - Invoice number (required)",
+    "invoice_date": "string - Invoice date (DD/MM/YYYY) (required)",
+    "invoice_type": "string - Type of invoice (default: TAX INVOICE)",
+    "document_type": "string - Document type (e.g., ORIGINAL FOR RECIPIENT)",
+
+    # E-Invoice specific fields
+    "is_einvoice": "boolean - Whether this is an E-Invoice",
+    "irn_number": "string - IRN number for E-Invoice",
+    "ack_no": "string - Acknowledgement number",
+    "ack_date": "string - Acknowledgement date",
+    "einvoice_status": "string - E-Invoice status (GENERATED, PENDING, FAILED)",
+    "show_qr_code": "boolean - Whether to show QR code",
+    "qr_code_data": "string - QR code data content",
+    "qr_format": "string - QR code image format: png (default) or svg",
+    "government_portal": "string - Government portal URL",
+    "einvoice_compliance_note": "string - Compliance note for E-Invoice",
+
+    # E-Way Bill specific fields
+    "is_ewaybill": "boolean - Whether this is an E-Way Bill",
+    "ewb_number": "string - E-Way Bill number",
+    "ewb_date": "string - E-Way Bill generation date",
+    "ewb_valid_until": "string - E-Way Bill validity date",
+    "ewaybill_status": "string - E-Way Bill status (GENERATED, PENDING, FAILED)",
+    "ewaybill_compliance_note": "string - Compliance note for E-Way Bill",
+
+    # Transport details for E-Way Bill
+    "transporter_name": "string - Transporter name",
+    "transporter_id": "string - Transporter ID/GSTIN",
+    "vehicle_number": "string - Vehicle registration number",
+    "driver_name": "string - Driver name",
+    "driver_mobile": "string - Driver mobile number",
+    "transport_distance": "string - Transport distance in KM",
+    "transport_mode": "string - Mode of transport (Road/Rail/Air/Ship)",
+    "from_place": "string - Origin place",
+    "from_pincode": "string - Origin pincode",
+    "to_place": "string - Destination place",
+    "to_pincode": "string - Destination pincode",
+    "has_extensions": "boolean - Whether E-Way Bill has extensions",
+    "extension_count": "number - Number of extensions applied",
+
+    # Company and customer details
+    "company_profile_id": "string - ID of a registered company profile supplying the company_*, bank_* and footer fields",
+    "company_name": "string - Company name (required)",
+    "company_address": "string - Company address",
+    "company_city": "string - Company city",
+    "company_gstin": "string - Company GSTIN",
+    "company_pan": "string - Company PAN",
+    "company_fssai": "string - Company FSSAI license",
+    "company_gst_state": "string - Company GST state",
+    "company_state_code": "string - Company state code",
+    "sm_name": "string - Sales manager name",
+    "beat_name": "string - Beat name",
+    "sm_contact": "string - Sales manager contact",
+    "sm_mobile": "string - Sales manager mobile",
+    "customer_name": "string - Customer name (required)",
+    "customer_address": "string - Customer address",
+    "retailer_code": "string - Retailer code",
+    "po_so_ref": "string - PO/SO reference",
+    "customer_pan": "string - Customer PAN",
+    "customer_gstin": "string - Customer GSTIN",
+    "payment_mode": "string - Payment mode",
+    "customer_contact": "string - Customer contact",
+    "drug_license": "string - Drug license number",
+    "customer_fssai": "string - Customer FSSAI",
+    "customer_gst_state": "string - Customer GST state",
+    "customer_state_code": "string - Customer state code",
+    "vehicle": "string - Vehicle information",
+
+    # Layout options
+    "paginate": "boolean - Split the product table into page-sized fragments with carried-forward subtotals",
+    "rows_per_page": "count - Product rows per page when paginate is set (default: 30)",
+    "first_page_rows": "count - Product rows on the first page, below the header, when paginate is set (default: 15)",
+
+    # Product details (required)
+    "products": [
+        {
+            "serial_no": "number - Serial number",
+            "hsn_code": "string - HSN code",
+            "product_name": "string - Product name",
+            "mrp": "string - MRP",
+            "cs": "string - Cases",
+            "qty": "string - Quantity",
+            "free": "string - Free quantity",
+            "upc": "string - UPC",
+            "gross_rate": "string - Gross rate",
+            "total": "string - Total amount",
+            "pri_disc": "string - Primary discount",
+            "sec_disc": "string - Secondary discount",
+            "lnd_disc": "string - L&D discount",
+            "taxable_amt": "string - Taxable amount",
+            "cgst_rate": "string - CGST rate",
+            "cgst_amt": "string - CGST amount",
+            "sgst_rate": "string - SGST rate",
+            "sgst_amt": "string - SGST amount",
+            "net_rate": "string - Net rate",
+            "net_value": "string - Net value"
+        }
+    ],
+
+    # Summary totals (computed server-side when compute_totals is set)
+    "compute_totals": "boolean - Compute line amounts, tax slabs, totals, round off and amount in words from qty, gross_rate, discounts and GST rates",
+    "total_items": "string - Total number of items",
+    "total_cs": "string - Total cases",
+    "total_qty": "string - Total quantity",
+    "total_free": "string - Total free quantity",
+    "grand_total": "string - Grand total",
+    "total_pri_disc": "string - Total primary discount",
+    "total_sec_disc": "string - Total secondary discount",
+    "total_lnd_disc": "string - Total L&D discount",
+    "total_taxable_amt": "string - Total taxable amount",
+    "total_cgst_amt": "string - Total CGST amount",
+    "total_sgst_amt": "string - Total SGST amount",
+
+    # Financial summary
+    "net_receivable": "string - Net receivable amount (required)",
+    "amount_in_words": "string - Amount in words",
+    "pre_tax_scheme_amt": "string - Pre-tax scheme amount",
+    "net_amount": "string - Net amount",
+    "total_cgst": "string - Total CGST",
+    "total_sgst": "string - Total SGST",
+    "cash_disc_deducted": "string - Cash discount deducted",
+    "tcs_tax_amt": "string - TCS tax amount",
+    "credit_adj": "string - Credit adjustment",
+    "round_off": "string - Round off amount",
+
+    # Footer details
+    "reverse_charge_basis": "string - Reverse charge basis (Yes/No)",
+    "return_policy_note": "string - Return policy note",
+    "jurisdiction": "string - Jurisdiction",
+    "bank_account_no": "string - Bank account number",
+    "bank_name": "string - Bank name",
+    "bank_ifsc": "string - Bank IFSC code",
+    "pdf_profile": "string - PDF size/quality profile: standard, compact or print (default: server setting)",
+    "company_logo": "string - Name of an uploaded asset (see /assets) shown in the header",
+    "signature_image": "string - Name of an uploaded asset (see /assets) shown above Authorised Signature"
+}
+
+# E-Way Bill specific schema, served by /ewaybill-schema
+EWAYBILL_SCHEMA = {
+    "required_fields": [
+        "invoice_number",
+        "invoice_date", 
+        "company_name",
+        "customer_name",
+        "products",
+        "net_receivable",
+        "ewb_number"
+    ],
+    "ewaybill_specific": {
+        "ewb_number": "string - E-Way Bill number (required)",
+        "ewb_date": "string - E-Way Bill generation date",
+        "ewb_valid_until": "string - E-Way Bill validity end date/time",
+        "ewaybill_status": "string - Status: GENERATED/PENDING/FAILED",
+        "transporter_name": "string - Name of the transporter",
+        "transporter_id": "string - Transporter GSTIN or ID",
+        "vehicle_number": "string - Vehicle registration number",
+        "driver_name": "string - Driver's name",
+        "driver_mobile": "string - Driver's mobile number",
+        "transport_distance": "string - Distance in kilometers",
+        "transport_mode": "string - Road/Rail/Air/Ship",
+        "from_place": "string - Origin city/place",
+        "from_pincode": "string - Origin pincode",
+        "to_place": "string - Destination city/place", 
+        "to_pincode": "string - Destination pincode",
+        "has_extensions": "boolean - Whether validity was extended",
+        "extension_count": "number - Number of extensions applied"
+    },
+    "note": "WeasyPrint PDF engine provides better compatibility than Playwright"
+}
+
+# Upper bound on errors reported for one payload
+MAX_VALIDATION_ERRORS = 50
+
+BOOLEAN_STRINGS = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+
+class ValidationError(ValueError):
+    """Payload validation failure carrying every problem found"""
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+def coerce_string(value):
+    """Accept strings, and numbers converted to strings"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise TypeError('expected a string')
+
+def coerce_number(value):
+    """Accept finite numbers, and numeric strings converted to int or float"""
+    if isinstance(value, str):
+        for parse in (int, float):
+            try:
+                value = parse(value.strip())
+                break
+            except ValueError:
+                pass
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if isinstance(value, float) and not math.isfinite(value):
+            raise TypeError('expected a finite number')
+        return value
+    raise TypeError('expected a number')
+
+def coerce_count(value):
+    """Accept positive whole numbers, such as row counts, as int"""
+    number = coerce_number(value)
+    if number != int(number) or number < 1:
+        raise TypeError('expected a positive whole number')
+    return int(number)
+
+def coerce_boolean(value):
+    """Accept booleans, 0/1, and true/false/yes/no strings"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in BOOLEAN_STRINGS:
+        return BOOLEAN_STRINGS[value.strip().lower()]
+    raise TypeError('expected a boolean')
+
+COERCERS = {'string': coerce_string, 'number': coerce_number, 'count': coerce_count, 'boolean': coerce_boolean}
+
+def schema_coercer(description):
+    """Pick the coercer named by the leading type word of a schema description"""
+    return COERCERS[description.split(' ', 1)[0]]
+
+class PayloadValidator:
+    """Single-pass payload validator compiled from a documented schema
+
+    Field types come from the leading word of each schema description and
+    required fields from a "(required)" marker, unless a required list is
+    given. Present fields are coerced in place; every error is collected
+    and raised together as one ValidationError.
+    """
+    def __init__(self, schema, required_fields=None, label=''):
+        self.label = label
+        self.products_field = None
+        self.product_fields = ()
+        fields = []
+        required = []
+        for name, spec in schema.items():
+            if isinstance(spec, list):
+                # The products array: compile its row schema separately
+                self.products_field = name
+                self.product_fields = tuple((field, schema_coercer(desc)) for field, desc in spec[0].items())
+                fields.append((name, None))
+                required.append(name)
+            else:
+                fields.append((name, schema_coercer(spec)))
+                if '(required)' in spec:
+                    required.append(name)
+        self.fields = tuple(fields)
+        self.required = tuple(required_fields if required_fields is not None else required)
     
-    def generate_pdf(self, invoice_data):
-        """Generate PDF using WeasyPrint instead of Playwright"""
-        try:
-            logger.info("Starting PDF generation with WeasyPrint...")
-            
-            # Generate HTML content
-            html_content = self.generate_html(invoice_data)
-            logger.info("HTML content generated successfully")
-            
-            # Convert HTML to PDF using WeasyPrint
-            pdf_bytes = weasyprint.HTML(string=html_content).write_pdf()
-            logger.info(f"PDF generated successfully with WeasyPrint, size: {len(pdf_bytes)} bytes")
-            
-            return pdf_bytes
-            
-        except Exception as e:
-            logger.error(f"Error generating PDF with WeasyPrint: {str(e)}")
-            logger.error(traceback.format_exc())
-            raise Exception(f"PDF generation failed: {str(e)}")
+    def validate(self, data, relax=None, check=None):
+        """Check and coerce every field, raising ValidationError with all problems found
 
-    def validate_invoice_data(self, data):
-        """Validate required fields in invoice data"""
-        required_fields = [
-            'invoice_number', 'invoice_date', 'company_name', 
-            'customer_name', 'products', 'net_receivable'
-        ]
-        
-        missing_fields = []
-        for field in required_fields:
-            if field not in data or not data[field]:
-                missing_fields.append(field)
-        
-        if missing_fields:
-            raise ValueError(f"Missing required fields: {', '.join(missing_fields)}")
+        relax(data) may return required fields to waive, and check(data) further
+        errors, once the payload's own flags have been coerced.
+        """
+        if not isinstance(data, dict):
+            raise ValidationError(['Payload must be a JSON object'])
         
-        # Validate products array
-        if not isinstance(data['products'], list) or len(data['products']) == 0:
-            raise ValueError("Products must be a non-empty array")
-        
-        return True
-
-    def validate_ewaybill_data(self, data):
-        """Validate required fields for E-Way Bill"""
-        required_fields = [
-            'invoice_number', 'invoice_date', 'company_name', 
-            'customer_name', 'products', 'net_receivable',
-            'ewb_number'  # E-Way Bill specific
-        ]
+        errors = []
+        for name, coerce in self.fields:
+            value = data.get(name)
+            if value is None or coerce is None:
+                continue
+            try:
+                data[name] = coerce(value)
+            except TypeError as e:
+                errors.append(f"{name}: {str(e)}")
         
-        missing_fields = []
-        for field in required_fields:
-            if field not in data or not data[field]:
-                missing_fields.append(field)
+        products = data.get(self.products_field)
+        if products:
+            if not isinstance(products, list):
+                errors.append("Products must be a non-empty array")
+            else:
+                self.validate_products(products, errors)
         
+        waived = relax(data) if relax else ()
+        missing_fields = [name for name in self.required if name not in waived and not data.get(name)]
         if missing_fields:
-            raise ValueError(f"Missing required fields for E-Way Bill: {', '.join(missing_fields)}")
-        
-        # Validate products array
-        if not isinstance(data['products'], list) or len(data['products']) == 0:
-            raise ValueError("Products must be a non-empty array")
+            errors.insert(0, f"Missing required fields{self.label}: {', '.join(missing_fields)}")
+        if check:
+            errors.extend(check(data))
         
+        if errors:
+            if len(errors) > MAX_VALIDATION_ERRORS:
+                errors = errors[:MAX_VALIDATION_ERRORS] + [f"... and {len(errors) - MAX_VALIDATION_ERRORS} more errors"]
+            raise ValidationError(errors)
         return True
+    
+    def validate_products(self, products, errors):
+        """Coerce every product row in place, appending per-cell errors"""
+        product_fields = self.product_fields
+        for index, product in enumerate(products):
+            if not isinstance(product, dict):
+                errors.append(f"products[{index}]: expected an object")
+                continue
+            for field, coerce in product_fields:
+                value = product.get(field)
+                if value is None:
+                    continue
+                try:
+                    product[field] = coerce(value)
+                except TypeError as e:
+                    errors.append(f"products[{index}].{field}: {str(e)}")
 
-# Initialize the invoice generator
-invoice_generator = InvoiceGenerator()
+def totals_relaxation(data):
+    """The totals engine derives net_receivable, so it is not required when compute_totals is set"""
+    return ('net_receivable',) if data.get('compute_totals') is True else ()
 
-@app.route('/generate-invoice', methods=['POST'])
-def generate_invoice():
-    """API endpoint to generate regular invoice"""
-    try:
-        logger.info(f"Received invoice generation request from {request.remote_addr}")
-        
-        # Get JSON data from request
-        invoice_data = request.get_json()
-        
-        if not invoice_data:
-            logger.error("No JSON data provided in request")
-            return jsonify({'error': 'No JSON data provided'}), 400
-        
-        logger.info(f"Processing invoice: {invoice_data.get('invoice_number', 'Unknown')}")
-        
-        # Validate the data
+def totals_input_errors(data):
+    """When compute_totals is set, every amount the totals engine reads must be blank or a finite number in range
+
+    Bounding the inputs keeps every product and sum within Decimal's 28 digits.
+    """
+    if data.get('compute_totals') is not True:
+        return []
+    errors = []
+    cells = [(f"products[{index}].{field}", field, product.get(field))
+             for index, product in enumerate(data.get('products') or []) if isinstance(product, dict)
+             for field in TOTALS_INPUT_FIELDS]
+    cells += [(field, field, data.get(field)) for field in ('tcs_tax_amt', 'credit_adj')]
+    for name, field, value in cells:
+        if value is None or value == '':
+            continue
         try:
-            invoice_generator.validate_invoice_data(invoice_data)
-            logger.info("Invoice data validation successful")
-        except ValueError as ve:
-            logger.error(f"Validation error: {str(ve)}")
-            return jsonify({'error': f'Validation error: {str(ve)}'}), 400
-        
-        # Get output format (html or pdf)
-        output_format = request.args.get('format', 'html').lower()
-        logger.info(f"Output format requested: {output_format}")
-        
-        if output_format == 'pdf':
-            try:
-                # Generate PDF using WeasyPrint
-                logger.info("Starting PDF generation with WeasyPrint...")
-                pdf_bytes = invoice_generator.generate_pdf(invoice_data)
-                logger.info(f"PDF generated successfully, size: {len(pdf_bytes)} bytes")
-                
-                # Create response
-                response = Response(pdf_bytes, mimetype='application/pdf')
-                response.headers['Content-Disposition'] = f'attachment; filename=invoice_{invoice_data["invoice_number"]}.pdf'
-                logger.info("PDF response prepared successfully")
+            amount = Decimal(str(value).replace(',', '').strip())
+        except InvalidOperation:
+            amount = None
+        if amount is None or not amount.is_finite():
+            errors.append(f"{name}: expected a finite number, got {value!r}")
+        elif field in GST_RATE_FIELDS and not 0 <= amount <= HUNDRED:
+            errors.append(f"{name}: expected a rate between 0 and 100, got {value!r}")
+        elif abs(amount) > TOTALS_INPUT_LIMIT:
+            errors.append(f"{name}: expected at most {TOTALS_INPUT_LIMIT:,} in magnitude, got {value!r}")
+    return errors
+
+# Seller fields a registered company profile supplies to the invoices that reference it
+COMPANY_PROFILE_FIELDS = (
+    'company_name', 'company_address', 'company_city', 'company_gstin', 'company_pan',
+    'company_fssai', 'company_gst_state', 'company_state_code', 'return_policy_note',
+    'jurisdiction', 'bank_account_no', 'bank_name', 'bank_ifsc', 'company_logo', 'signature_image'
+)
+# Longest accepted company profile ID
+MAX_PROFILE_ID_LENGTH = 64
+
+invoice_validator = PayloadValidator(TEMPLATE_SCHEMA)
+ewaybill_validator = PayloadValidator(
+    dict(TEMPLATE_SCHEMA, **EWAYBILL_SCHEMA['ewaybill_specific']),
+    required_fields=EWAYBILL_SCHEMA['required_fields'],
+    label=' for E-Way Bill'
+)
+profile_validator = PayloadValidator(
+    {field: TEMPLATE_SCHEMA[field] for field in COMPANY_PROFILE_FIELDS},
+    label=' for company profile'
+)
+
+# Product columns summed into per-page brought/carried forward subtotals
+PRODUCT_SUBTOTAL_FIELDS = (
+    'cs', 'qty', 'free', 'total', 'pri_disc', 'sec_disc', 'lnd_disc',
+    'taxable_amt', 'cgst_amt', 'sgst_amt', 'net_value'
+)
+QUANTITY_FIELDS = ('cs', 'qty', 'free')
+
+def to_decimal(value):
+    """Parse an amount sent as a string or number, treating blanks as zero
+    
+    Totals inputs are rejected up front by totals_input_errors; junk and
+    non-finite values in display-only columns count as zero in subtotals.
+    """
+    if value is None or value == '':
+        return Decimal(0)
+    try:
+        amount = Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        return Decimal(0)
+    return amount if amount.is_finite() else Decimal(0)
+
+def format_amount(value):
+    """Format a Decimal amount with two decimal places"""
+    return f"{value:.2f}"
+
+def format_quantity(value):
+    """Format a Decimal count without a trailing .00 when it is whole"""
+    return str(int(value)) if value == value.to_integral_value() else str(value.normalize())
+
+def paginate_products(products, rows_per_page, first_page_rows=None):
+    """Split products into page-sized chunks with brought/carried forward subtotals
+    
+    The first chunk holds first_page_rows (default rows_per_page), every later one rows_per_page.
+    """
+    running = dict.fromkeys(PRODUCT_SUBTOTAL_FIELDS, Decimal(0))
+    pages = []
+    start, size = 0, first_page_rows or rows_per_page
+    while start < len(products):
+        chunk = products[start:start + size]
+        brought_forward = format_subtotals(running) if pages else None
+        for product in chunk:
+            for field in PRODUCT_SUBTOTAL_FIELDS:
+                running[field] += to_decimal(product.get(field))
+        pages.append({'products': chunk, 'brought_forward': brought_forward, 'carried_forward': None})
+        start, size = start + size, rows_per_page
+    
+    # What one page carries forward is exactly what the next page brings forward
+    for page, next_page in zip(pages, pages[1:]):
+        page['carried_forward'] = next_page['brought_forward']
+    return pages
+
+def format_subtotals(sums):
+    """Format running column sums for display in a subtotal row"""
+    return {
+        field: format_quantity(value) if field in QUANTITY_FIELDS else format_amount(value)
+        for field, value in sums.items()
+    }
+
+PAISE = Decimal('0.01')
+HUNDRED = Decimal(100)
+
+# Raw product columns read by the totals engine
+TOTALS_INPUT_FIELDS = (
+    'cs', 'qty', 'free', 'gross_rate', 'pri_disc', 'sec_disc', 'lnd_disc', 'cgst_rate', 'sgst_rate'
+)
+GST_RATE_FIELDS = ('cgst_rate', 'sgst_rate')
+# Largest quantity or amount the totals engine accepts
+TOTALS_INPUT_LIMIT = Decimal(10) ** 9
+
+def compute_invoice_totals(invoice_data):
+    """Compute line amounts, GST slabs, totals, round-off and amount in words from raw products
+
+    Works column by column over the product list with exact Decimal arithmetic:
+    total = qty * gross_rate, taxable = total - discounts, GST = taxable * rate / 100
+    (rounded half-up to paise), net value = taxable + CGST + SGST.
+    Net receivable = grand total + TCS - credit adjustment, rounded to the rupee.
+    """
+    products = invoice_data['products']
+    columns = {
+        field: [to_decimal(product.get(field)) for product in products]
+        for field in TOTALS_INPUT_FIELDS
+    }
+    
+    totals = [(qty * rate).quantize(PAISE, ROUND_HALF_UP) for qty, rate in zip(columns['qty'], columns['gross_rate'])]
+    taxable = [
+        total - pri - sec - lnd
+        for total, pri, sec, lnd in zip(totals, columns['pri_disc'], columns['sec_disc'], columns['lnd_disc'])
+    ]
+    cgst = [(amount * rate / HUNDRED).quantize(PAISE, ROUND_HALF_UP) for amount, rate in zip(taxable, columns['cgst_rate'])]
+    sgst = [(amount * rate / HUNDRED).quantize(PAISE, ROUND_HALF_UP) for amount, rate in zip(taxable, columns['sgst_rate'])]
+    net_values = [amount + c + s for amount, c, s in zip(taxable, cgst, sgst)]
+    
+    # Write computed line amounts back onto each product row
+    computed_products = []
+    for index, product in enumerate(products):
+        qty = columns['qty'][index]
+        net_rate = (net_values[index] / qty).quantize(PAISE, ROUND_HALF_UP) if qty else Decimal(0)
+        computed_products.append(dict(
+            product,
+            serial_no=product.get('serial_no') or index + 1,
+            total=format_amount(totals[index]),
+            taxable_amt=format_amount(taxable[index]),
+            cgst_amt=format_amount(cgst[index]),
+            sgst_amt=format_amount(sgst[index]),
+            net_rate=format_amount(net_rate),
+            net_value=format_amount(net_values[index])
+        ))
+    invoice_data['products'] = computed_products
+    
+    # Slab-wise GST aggregation keyed on the (CGST, SGST) rate pair
+    slabs = {}
+    for rates, amount, c, s in zip(zip(columns['cgst_rate'], columns['sgst_rate']), taxable, cgst, sgst):
+        slab = slabs.setdefault(rates, [Decimal(0), Decimal(0), Decimal(0)])
+        slab[0] += amount
+        slab[1] += c
+        slab[2] += s
+    invoice_data['tax_slabs'] = [
+        {
+            'taxable_amount': format_amount(amount),
+            'cgst_rate': format_amount(cgst_rate),
+            'cgst_amount': format_amount(c),
+            'sgst_rate': format_amount(sgst_rate),
+            'sgst_amount': format_amount(s)
+        }
+        for (cgst_rate, sgst_rate), (amount, c, s) in sorted(slabs.items())
+    ]
+    
+    grand_total = sum(net_values, Decimal(0))
+    total_cgst = sum(cgst, Decimal(0))
+    total_sgst = sum(sgst, Decimal(0))
+    payable = grand_total + to_decimal(invoice_data.get('tcs_tax_amt')) - to_decimal(invoice_data.get('credit_adj'))
+    net_receivable = payable.quantize(Decimal(1), ROUND_HALF_UP)
+    
+    invoice_data.update({
+        'total_items': str(len(products)),
+        'total_cs': format_quantity(sum(columns['cs'], Decimal(0))),
+        'total_qty': format_quantity(sum(columns['qty'], Decimal(0))),
+        'total_free': format_quantity(sum(columns['free'], Decimal(0))),
+        'total_pri_disc': format_amount(sum(columns['pri_disc'], Decimal(0))),
+        'total_sec_disc': format_amount(sum(columns['sec_disc'], Decimal(0))),
+        'total_lnd_disc': format_amount(sum(columns['lnd_disc'], Decimal(0))),
+        'total_taxable_amt': format_amount(sum(taxable, Decimal(0))),
+        'total_cgst_amt': format_amount(total_cgst),
+        'total_sgst_amt': format_amount(total_sgst),
+        'total_cgst': format_amount(total_cgst),
+        'total_sgst': format_amount(total_sgst),
+        'grand_total': format_amount(grand_total),
+        'net_amount': format_amount(grand_total),
+        'round_off': format_amount(net_receivable - payable),
+        'net_receivable': format_amount(net_receivable),
+        'amount_in_words': amount_in_words(net_receivable)
+    })
+    return invoice_data
+
+NUMBER_WORDS = [
+    '', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine', 'Ten',
+    'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen', 'Seventeen', 'Eighteen', 'Nineteen'
+]
+TENS_WORDS = ['', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety']
+
+def number_to_words(number):
+    """Spell out a non-negative integer using the Indian system (thousand, lakh, crore)"""
+    if number < 20:
+        return NUMBER_WORDS[number]
+    if number < 100:
+        return ' '.join(filter(None, [TENS_WORDS[number // 10], NUMBER_WORDS[number % 10]]))
+    for divisor, name in ((10 ** 7, 'Crore'), (10 ** 5, 'Lakh'), (1000, 'Thousand'), (100, 'Hundred')):
+        if number >= divisor:
+            return ' '.join(filter(None, [
+                number_to_words(number // divisor), name, number_to_words(number % divisor)
+            ]))
+
+def amount_in_words(amount):
+    """Spell out a rupee amount, e.g. 'One Thousand Two Rupees and Fifty Paise Only' ('Minus ...' when negative)"""
+    amount = amount.quantize(PAISE, ROUND_HALF_UP)
+    sign = 'Minus ' if amount < 0 else ''
+    amount = abs(amount)
+    rupees = int(amount)
+    paise = int((amount - rupees) * 100)
+    words = f"{sign}{number_to_words(rupees) or 'Zero'} Rupees"
+    if paise:
+        words += f" and {number_to_words(paise)} Paise"
+    return words + " Only"
+
+def make_qr_code(qr_data, **kwargs):
+    """Build a QR code with the settings used on printed e-invoices"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=4,
+        border=1,
+        **kwargs
+    )
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    return qr
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def build_qr_png_base64(qr_data):
+    """Render a QR code to a base64 encoded PNG, memoized per qr_code_data"""
+    qr_img = make_qr_code(qr_data).make_image(fill_color="black", back_color="white")
+    
+    # Convert to base64
+    buffered = io.BytesIO()
+    qr_img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def build_qr_svg(qr_data):
+    """Render a QR code to inline SVG markup, memoized per qr_code_data"""
+    qr_img = make_qr_code(qr_data, image_factory=SvgPathImage).make_image()
+    return qr_img.to_string(encoding='unicode')
+
+# Asset names are flat file names with a known image extension
+ASSET_NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$')
+ASSET_MIME_TYPES = {
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif', '.webp': 'image/webp', '.svg': 'image/svg+xml'
+}
+# Payload fields that name an asset
+ASSET_FIELDS = ('company_logo', 'signature_image')
+
+class AssetFetcher(URLFetcher):
+    """WeasyPrint URL fetcher serving asset: URLs from the asset store; it never touches the network
+
+    The only other scheme allowed is data:, used by inline QR codes.
+    """
+    def __init__(self, store):
+        super().__init__(allowed_protocols={'data'})
+        self.store = store
+    
+    def fetch(self, url, headers=None):
+        if url.startswith('asset:'):
+            content, mime_type = self.store.load(url[len('asset:'):])
+            return URLFetcherResponse(url, content, {'Content-Type': mime_type})
+        return super().fetch(url, headers)
+
+class AssetStore:
+    """Logos and signatures stored under ASSET_DIR and served to WeasyPrint from memory
+
+    Asset names are immutable once uploaded, so cached copies never go stale:
+    the first render in a process reads and pre-scales the file, later renders
+    reuse the prepared bytes, and WeasyPrint's decoded images are shared between
+    renders through image_cache().
+    """
+    def __init__(self, directory, max_bytes, max_px, image_cache_entries):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_px = max_px
+        self.image_cache_entries = image_cache_entries
+        self.entries = OrderedDict()
+        self.size = 0
+        self.images = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'loads': 0, 'image_cache_resets': 0}
+        self.fetcher = AssetFetcher(self)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            logger.warning("Asset directory unavailable: %s", e)
+    
+    def path(self, name):
+        """Return the file path of an asset, rejecting names outside the store"""
+        if not ASSET_NAME_PATTERN.match(name) or os.path.splitext(name)[1].lower() not in ASSET_MIME_TYPES:
+            raise ValueError(f"Invalid asset name: {name}")
+        return os.path.join(self.directory, name)
+    
+    def exists(self, name):
+        """Whether an asset is available, answered from memory once it has been used"""
+        with self.lock:
+            if name in self.entries:
+                return True
+        return os.path.isfile(self.path(name))
+    
+    def load(self, name):
+        """Return (bytes, mime type) of an asset prepared for print, reading its file once per process"""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                self.entries.move_to_end(name)
+                self.stats['hits'] += 1
+                return entry
+        
+        with open(self.path(name), 'rb') as f:
+            entry = self.prepare(name, f.read())
+        with self.lock:
+            self.stats['loads'] += 1
+            if name not in self.entries and len(entry[0]) <= self.max_bytes:
+                self.entries[name] = entry
+                self.size += len(entry[0])
+                while self.size > self.max_bytes:
+                    _, (evicted, _) = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return entry
+    
+    def prepare(self, name, content):
+        """Scale a raster image down to max_px on its longest side; SVG is served unchanged"""
+        mime_type = ASSET_MIME_TYPES[os.path.splitext(name)[1].lower()]
+        if mime_type == 'image/svg+xml':
+            return content, mime_type
+        with Image.open(io.BytesIO(content)) as image:
+            if max(image.size) <= self.max_px:
+                return content, mime_type
+            image.thumbnail((self.max_px, self.max_px))
+            output_format, mime_type = ('JPEG', mime_type) if mime_type == 'image/jpeg' else ('PNG', 'image/png')
+            output = io.BytesIO()
+            image.save(output, format=output_format)
+        return output.getvalue(), mime_type
+    
+    def save(self, name, content):
+        """Store an uploaded image under a new name; return False if the name is taken"""
+        path = self.path(name)
+        if ASSET_MIME_TYPES[os.path.splitext(name)[1].lower()] == 'image/svg+xml':
+            if b'<svg' not in content[:4096]:
+                raise ValueError("Asset is not an SVG document")
+        else:
+            try:
+                with Image.open(io.BytesIO(content)) as image:
+                    image.verify()
+            except Exception:
+                raise ValueError("Asset is not a readable image")
+        
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        try:
+            # Linking fails if the name exists, so an uploaded asset is never replaced
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+    
+    def image_cache(self, pdf_profile):
+        """Return the dict WeasyPrint keeps decoded images in between renders of one PDF profile
+
+        Decoded images carry their profile's image options, hence one dict per
+        profile. A full cache is replaced rather than cleared, since renders still
+        using it read their entries back while writing the PDF.
+        """
+        with self.lock:
+            images = self.images.get(pdf_profile)
+            if images is None or len(images) > self.image_cache_entries:
+                if images is not None:
+                    self.stats['image_cache_resets'] += 1
+                images = self.images[pdf_profile] = {}
+            return images
+    
+    def get_stats(self):
+        """Return hit/load counters and memory usage for this process"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update({
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'decoded_images': sum(len(images) for images in self.images.values())
+            })
+        return stats
+
+def validate_asset_references(data):
+    """Reject payloads naming assets that were never uploaded"""
+    errors = []
+    for field in ASSET_FIELDS:
+        name = data.get(field)
+        if not name:
+            continue
+        try:
+            if not asset_store.exists(name):
+                errors.append(f"{field}: unknown asset {name}")
+        except ValueError as e:
+            errors.append(f"{field}: {str(e)}")
+    if errors:
+        raise ValidationError(errors)
+
+ASSET_SRC_PATTERN = re.compile(r'src="asset:([^"]+)"')
+
+def inline_assets(html_content):
+    """Replace asset: image sources, which only the PDF fetcher resolves, with data: URIs browsers can show"""
+    def data_uri(match):
+        content, mime_type = asset_store.load(match.group(1))
+        return f'src="data:{mime_type};base64,{base64.b64encode(content).decode()}"'
+    return ASSET_SRC_PATTERN.sub(data_uri, html_content)
+
+def pdf_profile_options(profile):
+    """Return the WeasyPrint layout and write options of a PDF profile"""
+    options = dict(PDF_PROFILES[profile])
+    if PDF_VERSION:
+        options.setdefault('pdf_version', PDF_VERSION)
+    return options
+
+def validate_pdf_profile(data):
+    """Reject payloads asking for an unknown PDF profile"""
+    profile = data.get('pdf_profile')
+    if profile and profile not in PDF_PROFILES:
+        raise ValidationError([f"pdf_profile: must be one of {', '.join(PDF_PROFILES)}"])
+
+class InvoiceGenerator:
+    def __init__(self):
+        self.template = Template(INVOICE_TEMPLATE)
+        self.fragment_templates = {name: Template(source) for name, source in COMPANY_FRAGMENT_TEMPLATES.items()}
+        # Parsed lazily, then shared by every PDF render in this process
+        self.stylesheet = None
+        self.font_config = None
+    
+    def get_stylesheet(self):
+        """Return the compiled invoice stylesheet and its font configuration, parsing once"""
+        if self.stylesheet is None:
+            self.font_config = FontConfiguration()
+            self.stylesheet = weasyprint.CSS(string=INVOICE_CSS, font_config=self.font_config)
+            logger.info("Invoice stylesheet compiled")
+        return self.stylesheet, self.font_config
+    
+    def generate_qr_code(self, qr_data):
+        """Generate QR code image and return base64 encoded string"""
+        try:
+            return build_qr_png_base64(qr_data)
+        except Exception as e:
+            logger.error("Error generating QR code: %s", e)
+            return None
+    
+    def generate_qr_svg(self, qr_data):
+        """Generate QR code as inline SVG markup, skipping the PIL/PNG/base64 round trip"""
+        try:
+            return build_qr_svg(qr_data)
+        except Exception as e:
+            logger.error("Error generating SVG QR code: %s", e)
+            return None
+    
+    def prepare_qr_code(self, invoice_data):
+        """Generate QR code if data is provided and attach it to the invoice data"""
+        if invoice_data.get('show_qr_code') and invoice_data.get('qr_code_data'):
+            with observe_stage('qr'):
+                if str(invoice_data.get('qr_format', QR_FORMAT)).lower() == 'svg':
+                    qr_key, qr_image = 'qr_code_svg', self.generate_qr_svg(invoice_data['qr_code_data'])
+                else:
+                    qr_key, qr_image = 'qr_code_base64', self.generate_qr_code(invoice_data['qr_code_data'])
+            if qr_image:
+                invoice_data[qr_key] = qr_image
+            else:
+                invoice_data['show_qr_code'] = False
+    
+    def render_company_fragments(self, company_data):
+        """Render the seller header/footer fragments from company fields"""
+        return {name: template.render(company_data) for name, template in self.fragment_templates.items()}
+    
+    def prepare_company_fragments(self, invoice_data):
+        """Attach the seller fragments, reusing a registered profile's pre-rendered copy when its fields are unchanged"""
+        profile_id = invoice_data.get('company_profile_id')
+        stored = company_profiles.get(profile_id) if profile_id else None
+        if stored and all(invoice_data.get(field) == stored['profile'].get(field) for field in COMPANY_PROFILE_FIELDS):
+            invoice_data['company_fragments'] = stored['fragments']
+        else:
+            invoice_data['company_fragments'] = self.render_company_fragments(invoice_data)
+    
+    def prepare_product_pages(self, invoice_data):
+        """Split the product table into page-sized fragments when paginate is requested"""
+        if invoice_data.get('paginate') and isinstance(invoice_data.get('products'), list):
+            invoice_data['product_pages'] = paginate_products(
+                invoice_data['products'],
+                invoice_data.get('rows_per_page') or ROWS_PER_PAGE,
+                invoice_data.get('first_page_rows') or FIRST_PAGE_ROWS
+            )
+    
+    def generate_html(self, invoice_data, inline_css=True):
+        """Generate HTML invoice from JSON data with QR code support
+
+        PDF renders pass inline_css=False and apply the precompiled stylesheet instead.
+        """
+        return RenderPipeline(self, invoice_data).html(inline_css)
+    
+    def stream_html(self, invoice_data):
+        """Yield the HTML of an enriched invoice in chunks as the template renders
+
+        Callers run RenderPipeline.validate() and enrich() first, so their
+        errors still get an error status. The header and styles are sent
+        while product rows are still being produced; template errors after
+        the first chunk cannot change the status, so they end the stream
+        early and are logged.
+        """
+        stream = self.template.stream(invoice_data, invoice_css=INVOICE_CSS)
+        stream.enable_buffering(STREAM_BUFFER_SIZE)
+        pending = ''
+        try:
+            for chunk in stream:
+                # Hold back an unfinished tag so an asset: image source is inlined whole
+                pending += chunk
+                cut = pending.rfind('<')
+                if cut == -1 or '>' in pending[cut:]:
+                    cut = len(pending)
+                yield inline_assets(pending[:cut])
+                pending = pending[cut:]
+            yield inline_assets(pending)
+        except Exception as e:
+            logger.error("Error streaming HTML: %s", e)
+    
+    def generate_pdf(self, invoice_data):
+        """Generate PDF using WeasyPrint instead of Playwright"""
+        return RenderPipeline(self, invoice_data).pdf()
+
+    def layout_html(self, html_content, pdf_profile=None):
+        """Lay out generated HTML with the shared stylesheet and font configuration
+
+        Image options (optimize_images, jpeg_quality, dpi) apply at layout time,
+        so the profile is needed here as well as when writing the PDF.
+        """
+        pdf_profile = pdf_profile or PDF_PROFILE
+        stylesheet, font_config = self.get_stylesheet()
+        with observe_stage('layout'):
+            return weasyprint.HTML(string=html_content, url_fetcher=asset_store.fetcher).render(
+                stylesheets=[stylesheet], font_config=font_config,
+                cache=asset_store.image_cache(pdf_profile), **pdf_profile_options(pdf_profile)
+            )
+
+    def render_document(self, invoice_data):
+        """Lay out an invoice with WeasyPrint and return the paginated document"""
+        return RenderPipeline(self, invoice_data).document()
+
+    def generate_combined_pdf(self, invoices):
+        """Lay out several invoices and write all their pages into one PDF"""
+        try:
+            documents = [self.render_document(invoice_data) for invoice_data in invoices]
+            
+            # Concatenate the already laid out pages; metadata and PDF profile come from the first document
+            all_pages = [page for document in documents for page in document.pages]
+            pdf_profile = invoices[0].get('pdf_profile') or PDF_PROFILE
+            with observe_stage('pdf_write'):
+                pdf_bytes = documents[0].copy(all_pages).write_pdf(**pdf_profile_options(pdf_profile))
+            PDF_BYTES.observe(len(pdf_bytes))
+            logger.info("Combined PDF generated for %s documents, %s pages, size: %s bytes", len(documents), len(all_pages), len(pdf_bytes))
+            
+            return pdf_bytes
+            
+        except Exception as e:
+            logger.exception("Error generating combined PDF with WeasyPrint: %s", e)
+            raise Exception(f"Combined PDF generation failed: {str(e)}")
+
+    def validate_invoice_data(self, data):
+        """Validate and coerce every documented invoice field in one pass"""
+        return invoice_validator.validate(data, relax=totals_relaxation, check=totals_input_errors)
+
+    def prepare_ewaybill_data(self, data):
+        """Set E-Way Bill specific flags and document defaults"""
+        data['is_ewaybill'] = True
+        data['invoice_type'] = data.get('invoice_type', 'TAX INVOICE WITH E-WAY BILL')
+        data['document_type'] = data.get('document_type', 'ORIGINAL FOR CONSIGNEE')
+        return data
+
+    def validate_ewaybill_data(self, data):
+        """Validate and coerce every documented E-Way Bill field in one pass"""
+        return ewaybill_validator.validate(data, relax=totals_relaxation, check=totals_input_errors)
+
+# Where the template leaves room for the stylesheet when it renders without one
+CSS_SLOT = '<!-- invoice-css -->'
+
+class RenderPipeline:
+    """One document's staged render: validate -> enrich (totals, QR, pages) -> HTML -> layout -> PDF
+
+    Each stage runs at most once and keeps its artifact (or its error), so later
+    stages, the HTML fallback after a failed PDF and /debug-pdf reuse the work
+    already done instead of repeating it.
+    """
+    def __init__(self, generator, data, kind=None):
+        self.generator = generator
+        self.data = data
+        self.kind = kind or ('ewaybill' if isinstance(data, dict) and data.get('is_ewaybill') else 'invoice')
+        self.artifacts = {}
+        self.errors = {}
+    
+    def _stage(self, name, produce):
+        if name in self.errors:
+            raise self.errors[name]
+        if name not in self.artifacts:
+            try:
+                self.artifacts[name] = produce()
+            except Exception as e:
+                self.errors[name] = e
+                raise
+        return self.artifacts[name]
+    
+    def validate(self):
+        """Validate and coerce the payload in place (E-Way Bills get their flags and defaults first)"""
+        def produce():
+            if not isinstance(self.data, dict):
+                raise ValidationError(['Payload must be a JSON object'])
+            apply_company_profile(self.data)
+            if self.kind == 'ewaybill':
+                self.generator.prepare_ewaybill_data(self.data)
+                self.generator.validate_ewaybill_data(self.data)
+            else:
+                self.generator.validate_invoice_data(self.data)
+            validate_asset_references(self.data)
+            validate_pdf_profile(self.data)
+            return True
+        return self._stage('validated', produce)
+    
+    def enrich(self):
+        """Compute totals, attach the QR code and split product pages"""
+        def produce():
+            if self.data.get('compute_totals'):
+                with observe_stage('totals'):
+                    compute_invoice_totals(self.data)
+            self.generator.prepare_qr_code(self.data)
+            self.generator.prepare_company_fragments(self.data)
+            self.generator.prepare_product_pages(self.data)
+            return self.data
+        return self._stage('enriched', produce)
+    
+    def html(self, inline_css=True):
+        """Render the template once; inline_css=True makes browser output (stylesheet spliced in, assets inlined)"""
+        def produce():
+            try:
+                self.enrich()
+                with observe_stage('jinja'):
+                    return self.generator.template.render(self.data, invoice_css=None)
+            except Exception as e:
+                logger.error("Error generating HTML: %s", e)
+                raise Exception(f"Error generating HTML: {str(e)}")
+        html_content = self._stage('html', produce)
+        if inline_css:
+            return inline_assets(html_content.replace(CSS_SLOT, f'<style>\n{INVOICE_CSS}\n    </style>', 1))
+        return html_content
+    
+    @property
+    def pdf_profile(self):
+        return self.data.get('pdf_profile') or PDF_PROFILE
+    
+    def document(self):
+        """Lay out the HTML with the shared stylesheet, font configuration and PDF profile"""
+        return self._stage('document', lambda: self.generator.layout_html(self.html(inline_css=False), self.pdf_profile))
+    
+    def pdf(self):
+        """Write the laid out document to PDF bytes"""
+        def produce():
+            try:
+                logger.info("Starting PDF generation with WeasyPrint...")
+                document = self.document()
+                with observe_stage('pdf_write'):
+                    pdf_bytes = document.write_pdf(**pdf_profile_options(self.pdf_profile))
+                PDF_BYTES.observe(len(pdf_bytes))
+                logger.info("PDF generated successfully with WeasyPrint (%s profile), size: %s bytes", self.pdf_profile, len(pdf_bytes))
+                return pdf_bytes
+            except Exception as e:
+                logger.exception("Error generating PDF with WeasyPrint: %s", e)
+                raise Exception(f"PDF generation failed: {str(e)}")
+        return self._stage('pdf', produce)
+
+# Changes whenever the template or stylesheet changes, so stale renders are never served
+TEMPLATE_VERSION = hashlib.sha256(
+    (INVOICE_TEMPLATE + INVOICE_CSS + ''.join(COMPANY_FRAGMENT_TEMPLATES.values())).encode()
+).hexdigest()[:16]
+
+class RenderCache:
+    """Content-addressed cache of rendered documents
+
+    A size-bounded in-process LRU sits in front of a disk tier that every
+    gunicorn worker on the host shares. Hit/miss counters are per process.
+    """
+    # Prune expired disk entries after this many stores
+    PRUNE_INTERVAL = 500
+
+    def __init__(self, max_bytes, directory, disk_ttl):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_ttl = disk_ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                logger.warning("Render cache disk tier disabled: %s", e)
+                self.directory = None
+    
+    def make_key(self, data, output_format, variant=''):
+        """Hash the canonical JSON form of a validated payload with format and template version"""
+        canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        digest = hashlib.sha256()
+        for part in (TEMPLATE_VERSION, output_format, variant, canonical):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+    
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss"""
+        with self.lock:
+            content = self.entries.get(key)
+            if content is not None:
+                self.entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return content
+        
+        if self.directory:
+            path = self._path(key)
+            try:
+                if time.time() - os.path.getmtime(path) <= self.disk_ttl:
+                    with open(path, 'rb') as f:
+                        content = f.read()
+                    self._remember(key, content)
+                    with self.lock:
+                        self.stats['disk_hits'] += 1
+                    return content
+            except OSError:
+                pass
+        
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+    
+    def contains(self, key):
+        """Whether key is cached, without reading the entry or counting a lookup"""
+        with self.lock:
+            if key in self.entries:
+                return True
+        if not self.directory:
+            return False
+        try:
+            return time.time() - os.path.getmtime(self._path(key)) <= self.disk_ttl
+        except OSError:
+            return False
+    
+    def put(self, key, content):
+        """Store rendered bytes in both tiers"""
+        self._remember(key, content)
+        with self.lock:
+            self.stats['stores'] += 1
+            prune = self.stats['stores'] % self.PRUNE_INTERVAL == 0
+        
+        if self.directory:
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temp file and rename so other workers never read a partial entry
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("Could not write render cache entry: %s", e)
+            if prune:
+                self.prune_disk()
+    
+    def _remember(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+    
+    def prune_disk(self):
+        """Delete disk entries older than the TTL"""
+        cutoff = time.time() - self.disk_ttl
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+    
+    def get_stats(self):
+        """Return hit/miss counters and memory tier usage for this process"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update({
+                'memory_entries': len(self.entries),
+                'memory_bytes': self.size,
+                'memory_max_bytes': self.max_bytes,
+                'disk_enabled': bool(self.directory),
+                'template_version': TEMPLATE_VERSION
+            })
+        return stats
+
+MB = 1024 * 1024
+
+class MemoryGovernor:
+    """Track this process's resident memory and budget PDF renders by their estimated footprint
+
+    WeasyPrint does not hand all layout memory back to the OS, so once RSS passes
+    the ceiling the worker asks to be recycled; gunicorn's post_request hook (see
+    gunicorn.conf.py) retires it after the response has been sent.
+    """
+    def __init__(self, ceiling_mb, budget_mb, base_mb, per_document_mb, per_product_mb):
+        self.ceiling = ceiling_mb * MB
+        self.budget = budget_mb * MB
+        self.base_mb = base_mb
+        self.per_document_mb = per_document_mb
+        self.per_product_mb = per_product_mb
+        self.recycle_requested = False
+        self.lock = threading.Lock()
+        self.stats = {'renders': 0, 'last_rss_bytes': 0, 'peak_rss_bytes': 0, 'rejected': 0, 'deferred': 0}
+    
+    def rss_bytes(self):
+        """Current resident set size (peak RSS where /proc is unavailable)"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * resource.getpagesize()
+        except (OSError, ValueError, IndexError):
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+    
+    def estimate(self, items):
+        """Estimate the bytes needed to lay out the given payloads as one render
+        
+        The items of a combined PDF share one stylesheet and font set, so the base
+        cost is charged once; each document and product row adds its own share.
+        """
+        products = sum(len(item.get('products') or []) for item in items if isinstance(item, dict))
+        return int((self.base_mb + self.per_document_mb * len(items) + self.per_product_mb * products) * MB)
+    
+    def admit(self, items):
+        """Return 'ok', 'reject' when the render exceeds the budget, or 'defer' when this worker lacks headroom"""
+        estimate = self.estimate(items)
+        if estimate > self.budget:
+            verdict, counter = 'reject', 'rejected'
+        elif self.rss_bytes() + estimate > self.ceiling:
+            verdict, counter = 'defer', 'deferred'
+        else:
+            return 'ok'
+        with self.lock:
+            self.stats[counter] += 1
+            # A worker too full for this render is retired once it has answered
+            if verdict == 'defer':
+                self.recycle_requested = True
+        logger.warning("Render %s by memory governor: estimated %s MB", counter, estimate // MB)
+        return verdict
+    
+    def record_render(self):
+        """Sample RSS after a render and request a recycle once it passes the ceiling"""
+        rss = self.rss_bytes()
+        with self.lock:
+            self.stats['renders'] += 1
+            self.stats['last_rss_bytes'] = rss
+            self.stats['peak_rss_bytes'] = max(self.stats['peak_rss_bytes'], rss)
+            if rss <= self.ceiling or self.recycle_requested:
+                return
+            self.recycle_requested = True
+        logger.warning("Worker RSS %s MB passed the %s MB ceiling, recycling after this request", rss // MB, self.ceiling // MB)
+    
+    def get_stats(self):
+        """Return this process's memory usage, limits and governor counters"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats.update({
+            'pid': os.getpid(),
+            'rss_bytes': self.rss_bytes(),
+            'ceiling_bytes': self.ceiling,
+            'render_budget_bytes': self.budget,
+            'recycle_requested': self.recycle_requested
+        })
+        return stats
+
+# Minimal invoice used by the warm-up render and /debug-pdf
+SAMPLE_INVOICE = {
+    'invoice_number': 'TEST001',
+    'invoice_date': '01/01/2025',
+    'company_name': 'Test Company',
+    'customer_name': 'Test Customer',
+    'products': [{
+        'serial_no': 1,
+        'product_name': 'Test Product',
+        'hsn_code': '12345',
+        'mrp': '100',
+        'qty': '1',
+        'net_value': '100'
+    }],
+    'net_receivable': '100'
+}
+
+# Warm the rendering stack at server start: in the gunicorn master before it forks when
+# preload_app is set, otherwise in each worker. Batch pool processes and the CLI skip it
+WARM_UP = os.getenv('WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+STARTUP_TIMINGS = {}
+
+if PDF_PROFILE not in PDF_PROFILES:
+    logger.warning("Unknown PDF_PROFILE %s, using standard", PDF_PROFILE)
+    PDF_PROFILE = 'standard'
+
+# Initialize the asset store, invoice generator and render cache
+asset_store = AssetStore(ASSET_DIR, ASSET_CACHE_BYTES, ASSET_MAX_PX, IMAGE_CACHE_ENTRIES)
+invoice_generator = InvoiceGenerator()
+render_cache = RenderCache(CACHE_MAX_BYTES, CACHE_DIR, CACHE_DISK_TTL)
+memory_governor = MemoryGovernor(
+    MEMORY_CEILING_MB, MEMORY_RENDER_BUDGET_MB, RENDER_BASE_MB, RENDER_MB_PER_DOCUMENT, RENDER_MB_PER_PRODUCT
+)
+
+def render_cache_key(pipeline, output_format):
+    """Cache key of a validated pipeline's document under the current rendering settings"""
+    variant = f'qr={QR_FORMAT};pdf={PDF_PROFILE};version={PDF_VERSION};rows={ROWS_PER_PAGE};first_rows={FIRST_PAGE_ROWS}'
+    return render_cache.make_key(pipeline.data, output_format, variant=variant)
+
+def render_with_cache(pipeline, output_format):
+    """Return (content bytes, cache_hit) for a validated pipeline, rendering only on a miss
+
+    The pipeline keeps whatever stages ran, so a caller can fall back to its HTML.
+    """
+    cache_key = render_cache_key(pipeline, output_format)
+    content = render_cache.get(cache_key)
+    CACHE_LOOKUPS.labels('hit' if content is not None else 'miss').inc()
+    if content is not None:
+        return content, True
+    
+    if output_format == 'pdf':
+        started = time.perf_counter()
+        content = pipeline.pdf()
+        admission_control.calibrate([pipeline.data], time.perf_counter() - started)
+    else:
+        content = pipeline.html().encode()
+    memory_governor.record_render()
+    render_cache.put(cache_key, content)
+    return content, False
+
+# Process pool for batch rendering, created lazily so gunicorn workers never fork it
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def init_batch_worker():
+    """Prepare a batch worker process; it is not warmed up, as its first item pays that cost anyway"""
+    logging.getLogger().setLevel(logging.WARNING)
+
+def get_batch_pool():
+    """Return the shared batch process pool, starting it on first use"""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            logger.info("Starting batch render pool with %s workers", BATCH_WORKERS)
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=BATCH_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_batch_worker,
+                max_tasks_per_child=BATCH_MAX_TASKS_PER_CHILD or None,
+            )
+        return _batch_pool
+
+def reset_batch_pool(pool):
+    """Discard a broken batch pool so the next batch starts a fresh one
+    
+    A pool another thread has already replaced is left alone.
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is not pool:
+            return
+        _batch_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def validate_batch_item(item):
+    """Validate one batch item as an invoice, or as an E-Way Bill when is_ewaybill is set, returning its pipeline"""
+    if not isinstance(item, dict) or not item:
+        raise ValueError("Batch item must be a non-empty JSON object")
+    pipeline = RenderPipeline(invoice_generator, item)
+    pipeline.validate()
+    return pipeline
+
+def render_pdf_item(item):
+    """Validate and render one batch item to PDF inside a pool worker, returning the raw bytes"""
+    invoice_number = item.get('invoice_number') if isinstance(item, dict) else None
+    try:
+        pipeline = validate_batch_item(item)
+        if memory_governor.estimate([item]) > memory_governor.budget:
+            return {'status': 'failed', 'invoice_number': invoice_number, 'error': 'Invoice too large for the render memory budget'}
+        pdf_bytes, _ = render_with_cache(pipeline, 'pdf')
+        return {'status': 'success', 'invoice_number': invoice_number, 'pdf_bytes': pdf_bytes}
+    except ValueError as ve:
+        return {'status': 'failed', 'invoice_number': invoice_number, 'error': f'Validation error: {str(ve)}'}
+    except Exception as e:
+        return {'status': 'failed', 'invoice_number': invoice_number, 'error': str(e)}
+
+def render_batch_item(item):
+    """Validate and render one batch item to PDF inside a pool worker, base64 encoded for JSON"""
+    result = render_pdf_item(item)
+    pdf_bytes = result.pop('pdf_bytes', None)
+    if pdf_bytes is not None:
+        result['pdf_size'] = len(pdf_bytes)
+        result['pdf_base64'] = base64.b64encode(pdf_bytes).decode()
+    return result
+
+class SlotTimeout(Exception):
+    """No scheduler slot became free within the allowed wait"""
+
+def submit_bulk(fn, item, *args):
+    """Wait for a bulk-lane slot, then run fn(item, *args) on the batch pool
+    
+    Returns (future, pool); the slot is released when the future finishes.
+    Raises SlotTimeout when no slot frees up within BULK_SLOT_TIMEOUT.
+    """
+    token = render_scheduler.acquire('bulk', admission_control.estimate([item]), BULK_SLOT_TIMEOUT)
+    if token is None:
+        raise SlotTimeout(f'No bulk render slot became free within {BULK_SLOT_TIMEOUT:g}s')
+    pool = None
+    try:
+        pool = get_batch_pool()
+        future = pool.submit(fn, item, *args)
+    except BaseException as e:
+        render_scheduler.release(token)
+        if isinstance(e, BrokenProcessPool):
+            reset_batch_pool(pool)
+        raise
+    future.add_done_callback(lambda _: render_scheduler.release(token))
+    return future, pool
+
+def render_batch(items):
+    """Render batch items concurrently on the process pool as bulk slots free up, preserving input order"""
+    futures = []
+    pool = None
+    try:
+        for item in items:
+            future, pool = submit_bulk(render_batch_item, item)
+            futures.append(future)
+        return [future.result() for future in futures]
+    except SlotTimeout:
+        # The batch is refused as a whole, so drop the items that have not started
+        for future in futures:
+            future.cancel()
+        raise
+    except BrokenProcessPool:
+        reset_batch_pool(pool)
+        raise Exception("Batch render pool crashed, please retry")
+
+class CompanyProfileStore:
+    """Registered company profiles in a local SQLite database shared by all gunicorn workers
+
+    A profile's seller fragments are rendered when it is saved and stored with
+    it. Each process keeps recently used profiles in memory and checks them
+    against the stored digest, so an update made through another worker is
+    picked up on the next render.
+    """
+    def __init__(self, path, cache_size):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        with closing(self.connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS company_profiles (
+                    id TEXT PRIMARY KEY,
+                    profile TEXT NOT NULL,
+                    fragments TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+    
+    def connect(self):
+        """Open a connection; one per call keeps the store safe to use from any thread"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def save(self, profile_id, profile, fragments):
+        """Create or replace a validated profile with its pre-rendered fragments; return True if it is new"""
+        profile_json = json.dumps(profile, sort_keys=True)
+        digest = hashlib.sha256(profile_json.encode()).hexdigest()
+        with closing(self.connect()) as conn:
+            created = conn.execute('SELECT 1 FROM company_profiles WHERE id = ?', (profile_id,)).fetchone() is None
+            conn.execute(
+                'INSERT OR REPLACE INTO company_profiles (id, profile, fragments, digest, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (profile_id, profile_json, json.dumps(fragments), digest, time.time())
+            )
+        with self.lock:
+            self.cache.pop(profile_id, None)
+        return created
+    
+    def get(self, profile_id):
+        """Return {'profile', 'fragments', 'updated_at'} for a registered profile, or None"""
+        with closing(self.connect()) as conn:
+            row = conn.execute('SELECT digest FROM company_profiles WHERE id = ?', (profile_id,)).fetchone()
+            if row is None:
+                with self.lock:
+                    self.cache.pop(profile_id, None)
+                return None
+            with self.lock:
+                cached = self.cache.get(profile_id)
+                if cached is not None and cached['digest'] == row['digest']:
+                    self.cache.move_to_end(profile_id)
+                    return cached
+            row = conn.execute('SELECT * FROM company_profiles WHERE id = ?', (profile_id,)).fetchone()
+        if row is None:
+            return None
+        
+        entry = {
+            'profile': json.loads(row['profile']),
+            'fragments': json.loads(row['fragments']),
+            'digest': row['digest'],
+            'updated_at': row['updated_at']
+        }
+        with self.lock:
+            self.cache[profile_id] = entry
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return entry
+    
+    def delete(self, profile_id):
+        """Remove a profile; return whether it existed"""
+        with closing(self.connect()) as conn:
+            deleted = conn.execute('DELETE FROM company_profiles WHERE id = ?', (profile_id,)).rowcount > 0
+        with self.lock:
+            self.cache.pop(profile_id, None)
+        return deleted
+
+company_profiles = CompanyProfileStore(PROFILE_DB_PATH, PROFILE_CACHE_SIZE)
+
+def apply_company_profile(data):
+    """Fill the company fields of a payload from its company_profile_id; fields sent inline take precedence"""
+    profile_id = data.get('company_profile_id') if isinstance(data, dict) else None
+    if not profile_id:
+        return
+    stored = company_profiles.get(str(profile_id))
+    if stored is None:
+        raise ValidationError([f"Unknown company_profile_id: {profile_id}"])
+    for field, value in stored['profile'].items():
+        if data.get(field) in (None, ''):
+            data[field] = value
+
+class ZipSink(io.RawIOBase):
+    """Write-only, unseekable file for zipfile whose output is drained chunk by chunk into a response"""
+    def __init__(self):
+        self.chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def archive_entry_name(index, item, extension='pdf'):
+    """Name a batch item's document, prefixed with its position so names are unique"""
+    item = item if isinstance(item, dict) else {}
+    kind, number = ('ewaybill', item.get('ewb_number')) if item.get('is_ewaybill') else ('invoice', item.get('invoice_number'))
+    safe_number = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(number or 'unknown'))[:64]
+    return f'{index + 1:05d}_{kind}_{safe_number}.{extension}'
+
+def stream_batch_zip(items):
+    """Yield a ZIP of the batch's PDFs, adding each one as soon as the pool finishes it
+
+    At most ZIP_WINDOW renders are in flight, so memory stays flat however large
+    the batch is. Entries arrive in completion order; manifest.json, written
+    last, lists every item's outcome in input order.
+    """
+    sink = ZipSink()
+    manifest = [None] * len(items)
+    pending = {}
+    remaining = iter(enumerate(items))
+    # PDF streams are already compressed, so entries are stored as-is
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        try:
+            while True:
+                for index, item in remaining:
+                    try:
+                        future, pool = submit_bulk(render_pdf_item, item)
+                    except SlotTimeout as e:
+                        # The 200 has already gone out, so items left without a slot are reported in the manifest
+                        logger.warning("ZIP batch gave up waiting for render slots: %s", e)
+                        for skipped, skipped_item in [(index, item), *remaining]:
+                            number = skipped_item.get('invoice_number') if isinstance(skipped_item, dict) else None
+                            manifest[skipped] = {'index': skipped, 'status': 'failed', 'invoice_number': number, 'error': str(e)}
+                        break
+                    pending[future] = (index, pool)
+                    if len(pending) >= ZIP_WINDOW:
+                        break
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, pool = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        reset_batch_pool(pool)
+                        result = {'status': 'failed', 'invoice_number': None, 'error': 'Batch render pool crashed'}
+                    
+                    entry = {'index': index, 'status': result['status'], 'invoice_number': result['invoice_number']}
+                    if result['status'] == 'success':
+                        entry['file'] = archive_entry_name(index, items[index])
+                        archive.writestr(entry['file'], result['pdf_bytes'])
+                    else:
+                        entry['error'] = result['error']
+                    manifest[index] = entry
+                yield sink.drain()
+        finally:
+            # The client went away (or the stream failed): drop renders that have not started
+            for future in pending:
+                future.cancel()
+        
+        failed = sum(1 for entry in manifest if entry['status'] != 'success')
+        logger.info("ZIP batch completed: %s succeeded, %s failed", len(manifest) - failed, failed)
+        archive.writestr('manifest.json', json.dumps({
+            'count': len(manifest),
+            'succeeded': len(manifest) - failed,
+            'failed': failed,
+            'results': manifest
+        }, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+    yield sink.drain()
+
+class JobQueue:
+    """Durable render job queue in a local SQLite database shared by all gunicorn workers
+
+    Jobs move queued -> running -> done/failed. A running job whose worker
+    died is handed out again once it has been running for JOB_STALE_AFTER,
+    and failed instead once it has used up JOB_MAX_ATTEMPTS.
+    """
+    # Purge expired jobs after this many enqueues
+    PURGE_INTERVAL = 200
+
+    def __init__(self, path):
+        self.path = path
+        self.enqueued = 0
+        with closing(self.connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    result BLOB
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)')
+    
+    def connect(self):
+        """Open a connection; one per call keeps the queue safe to use from any thread"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def enqueue(self, kind, data, output_format):
+        """Store a validated payload and return the new job ID"""
+        job_id = uuid.uuid4().hex
+        with closing(self.connect()) as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, output_format, payload, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, output_format, json.dumps(data), 'queued', time.time())
+            )
+        self.enqueued += 1
+        if self.enqueued % self.PURGE_INTERVAL == 0:
+            self.purge()
+        return job_id
+    
+    def claim(self):
+        """Atomically take the oldest runnable job, or return None when the queue is empty"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            abandoned = conn.execute(
+                """UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, payload = ''
+                   WHERE status = 'running' AND started_at < ? AND attempts >= ?""",
+                (now, f'Render worker stopped responding on all {JOB_MAX_ATTEMPTS} attempts', now - JOB_STALE_AFTER, JOB_MAX_ATTEMPTS)
+            ).rowcount
+            row = conn.execute(
+                '''SELECT * FROM jobs
+                   WHERE status = 'queued' OR (status = 'running' AND started_at < ?)
+                   ORDER BY created_at LIMIT 1''',
+                (now - JOB_STALE_AFTER,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now, row['id'])
+                )
+            conn.execute('COMMIT')
+            if abandoned:
+                logger.warning("Failed %s render jobs that exhausted %s attempts", abandoned, JOB_MAX_ATTEMPTS)
+            return dict(row) if row is not None else None
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def complete(self, job_id, result):
+        """Store a finished job's document and drop its payload"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, result = ?, payload = '' WHERE id = ?",
+                (time.time(), result, job_id)
+            )
+    
+    def requeue(self, job_id):
+        """Put a claimed job back at its place in the queue without counting the attempt"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, attempts = attempts - 1 WHERE id = ?",
+                (job_id,)
+            )
+    
+    def fail(self, job_id, error):
+        """Mark a job as failed with its error message"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, payload = '' WHERE id = ?",
+                (time.time(), error, job_id)
+            )
+    
+    def get(self, job_id, with_result=False):
+        """Return a job as a dict (result bytes only when asked for), or None"""
+        columns = '*' if with_result else 'id, kind, output_format, status, created_at, started_at, finished_at, attempts, error'
+        with closing(self.connect()) as conn:
+            row = conn.execute(f'SELECT {columns} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+    
+    def purge(self):
+        """Delete finished jobs older than JOB_RESULT_TTL"""
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - JOB_RESULT_TTL,)
+            )
+
+job_queue = JobQueue(JOB_DB_PATH)
+_job_workers_started = False
+_job_workers_lock = threading.Lock()
+
+def render_job_item(data, output_format):
+    """Render one queued (already validated) job inside a pool worker and return the document bytes"""
+    content, _ = render_with_cache(RenderPipeline(invoice_generator, data), output_format)
+    return content
+
+def job_worker_loop():
+    """Drain the job queue, handing each render to the process pool in the bulk lane"""
+    while True:
+        try:
+            job = job_queue.claim()
+        except Exception as e:
+            logger.error("Could not claim render job: %s", e)
+            job = None
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        
+        pool = None
+        try:
+            data = json.loads(job['payload'])
+            future, pool = submit_bulk(render_job_item, data, job['output_format'])
+            job_queue.complete(job['id'], future.result())
+            logger.info("Render job %s completed", job['id'])
+        except SlotTimeout as e:
+            logger.warning("Requeueing render job %s: %s", job['id'], e)
+            job_queue.requeue(job['id'])
+        except BrokenProcessPool:
+            reset_batch_pool(pool)
+            job_queue.fail(job['id'], 'Render worker crashed')
+        except Exception as e:
+            logger.error("Render job %s failed: %s", job['id'], e)
+            job_queue.fail(job['id'], str(e))
+
+def start_job_workers():
+    """Start the background job drainers once per process (after any gunicorn fork)"""
+    global _job_workers_started
+    with _job_workers_lock:
+        if _job_workers_started:
+            return
+        for index in range(JOB_WORKERS):
+            threading.Thread(target=job_worker_loop, name=f'render-job-worker-{index}', daemon=True).start()
+        _job_workers_started = True
+        logger.info("Started %s render job workers", JOB_WORKERS)
+
+@app.before_request
+def ensure_job_workers():
+    """Lazily start this worker's job drainers on its first request"""
+    if not _job_workers_started:
+        start_job_workers()
+
+def wants_async():
+    """Whether the client asked for a queued render with ?async=1"""
+    return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+def wants_stream():
+    """Whether the client asked for a streamed HTML response with ?stream=1"""
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+class IdempotencyStore:
+    """Claims and stored responses for idempotent requests in a local SQLite database shared by all gunicorn workers
+
+    The first request for a key claims it and renders; duplicates wait until its
+    response is stored and then replay it, as do retries within IDEMPOTENCY_TTL.
+    A claim still running after IDEMPOTENCY_LOCK_TIMEOUT is taken over.
+    """
+    # Purge expired entries after this many claims
+    PURGE_INTERVAL = 200
+    # Response headers not worth replaying
+    SKIPPED_HEADERS = ('Content-Length', 'Server-Timing')
+
+    # Longest pause between checks on a claim held by another process
+    MAX_POLL_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self.claims = 0
+        # Signalled whenever a claim held in this process finishes
+        self.finished = threading.Condition()
+        with closing(self.connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS idempotency (
+                    key TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    finished_at REAL,
+                    status_code INTEGER,
+                    headers TEXT,
+                    body BLOB
+                )
+            ''')
+    
+    def connect(self):
+        """Open a connection; one per call keeps the store safe to use from any thread"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def claim(self, key, fingerprint, replace_on_mismatch):
+        """Try to take a key
+
+        Returns ('owner', token) when the caller should render, ('replay', row)
+        for a stored response, ('mismatch', None) when the key belongs to a
+        different request, or ('wait', None) while another attempt is running.
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT * FROM idempotency WHERE key = ?', (key,)).fetchone()
+            expired = row is not None and (
+                (row['status'] == 'done' and row['finished_at'] < now - IDEMPOTENCY_TTL) or
+                (row['status'] == 'running' and row['started_at'] < now - IDEMPOTENCY_LOCK_TIMEOUT)
+            )
+            if row is None or expired or (row['fingerprint'] != fingerprint and replace_on_mismatch):
+                token = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, fingerprint, token, status, started_at) VALUES (?, ?, ?, 'running', ?)",
+                    (key, fingerprint, token, now)
+                )
+                conn.execute('COMMIT')
+                outcome = ('owner', token)
+            else:
+                conn.execute('COMMIT')
+                if row['fingerprint'] != fingerprint:
+                    outcome = ('mismatch', None)
+                elif row['status'] == 'done':
+                    outcome = ('replay', dict(row))
+                else:
+                    outcome = ('wait', None)
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        
+        self.claims += 1
+        if self.claims % self.PURGE_INTERVAL == 0:
+            self.purge()
+        return outcome
+    
+    def complete(self, key, token, response):
+        """Store the owner's response for replay"""
+        headers = [(name, value) for name, value in response.headers.items() if name not in self.SKIPPED_HEADERS]
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "UPDATE idempotency SET status = 'done', finished_at = ?, status_code = ?, headers = ?, body = ? WHERE key = ? AND token = ?",
+                (time.time(), response.status_code, json.dumps(headers), response.get_data(), key, token)
+            )
+        self.notify()
+    
+    def release(self, key, token):
+        """Drop the owner's claim without a stored response, so the next retry renders again"""
+        with closing(self.connect()) as conn:
+            conn.execute('DELETE FROM idempotency WHERE key = ? AND token = ?', (key, token))
+        self.notify()
+    
+    def notify(self):
+        """Wake this process's waiting duplicates to check their claims again"""
+        with self.finished:
+            self.finished.notify_all()
+    
+    def wait(self, key, fingerprint, replace_on_mismatch, timeout):
+        """Claim a key, waiting up to timeout while another attempt is running
+        
+        Returns claim()'s outcome; ('wait', None) once the timeout has passed.
+        Waiters wake as soon as an attempt in this process finishes, and check on
+        attempts in other workers with a backoff of up to MAX_POLL_INTERVAL.
+        """
+        deadline = time.monotonic() + timeout
+        interval = 0.05
+        while True:
+            outcome = self.claim(key, fingerprint, replace_on_mismatch)
+            remaining = deadline - time.monotonic()
+            if outcome[0] != 'wait' or remaining <= 0:
+                return outcome
+            with self.finished:
+                self.finished.wait(min(interval, remaining))
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+    
+    def purge(self):
+        """Delete expired responses and abandoned claims"""
+        now = time.time()
+        with closing(self.connect()) as conn:
+            conn.execute(
+                "DELETE FROM idempotency WHERE (status = 'done' AND finished_at < ?) OR (status = 'running' AND started_at < ?)",
+                (now - IDEMPOTENCY_TTL, now - IDEMPOTENCY_LOCK_TIMEOUT)
+            )
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_DB_PATH)
+
+def idempotency_key():
+    """Return (store key, whether a different payload may take the key over) for this request, or (None, False)
+
+    Keys are scoped by endpoint and output format. An explicit Idempotency-Key
+    is bound to its first payload; the invoice_number fallback simply starts
+    over when the payload has changed (a corrected invoice).
+    """
+    scope = f"{request.endpoint}:{request.args.get('format', 'html').lower()}"
+    header_key = request.headers.get('Idempotency-Key', '').strip()
+    if header_key:
+        return f'{scope}:key:{header_key[:255]}', False
+    
+    data = request.get_json(silent=True)
+    invoice_number = data.get('invoice_number') if isinstance(data, dict) else None
+    if IDEMPOTENCY_INVOICE_FALLBACK and invoice_number:
+        return f'{scope}:invoice:{invoice_number}', True
+    return None, False
+
+def request_fingerprint():
+    """Hash the request's payload and query parameters"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(request.get_json(silent=True), sort_keys=True, default=str).encode())
+    digest.update(b'\0')
+    digest.update(json.dumps(sorted(request.args.items(multi=True))).encode())
+    return digest.hexdigest()
+
+def replay_response(row):
+    """Rebuild a stored response"""
+    response = Response(row['body'], status=row['status_code'], headers=json.loads(row['headers']))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(view):
+    """Serve retries of a render request from its first attempt instead of rendering again
+
+    A duplicate arriving while the first attempt renders waits up to
+    IDEMPOTENCY_WAIT for its response, then gets 409 with Retry-After.
+    Streamed responses cannot be stored, and server errors and load-shedding
+    429s should be retried, so none is kept: the claim is released and the
+    next retry renders.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with observe_stage('json_parse'):
+            key, replace_on_mismatch = idempotency_key()
+        if key is None or wants_stream():
+            return view(*args, **kwargs)
+        
+        outcome, detail = idempotency_store.wait(key, request_fingerprint(), replace_on_mismatch, IDEMPOTENCY_WAIT)
+        if outcome == 'replay':
+            logger.info("Replaying stored response for %s", key)
+            return replay_response(detail)
+        if outcome == 'mismatch':
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if outcome == 'wait':
+            response = jsonify({'error': 'The original request is still being processed, please retry'})
+            response.status_code = 409
+            response.headers['Retry-After'] = '1'
+            return response
+        token = detail
+        
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.release(key, token)
+            raise
+        if response.is_streamed or response.status_code >= 500 or response.status_code == 429:
+            idempotency_store.release(key, token)
+        else:
+            idempotency_store.complete(key, token, response)
+        return response
+    return wrapper
+
+def enqueue_render_job(kind, data, output_format):
+    """Queue a validated render and answer 202 with the job's status URL"""
+    output_format = 'pdf' if output_format == 'pdf' else 'html'
+    job_id = job_queue.enqueue(kind, data, output_format)
+    logger.info("Queued %s render job %s (%s)", kind, job_id, output_format)
+    status_url = f'/jobs/{job_id}'
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+def memory_rejection(retry_after=None):
+    """Answer 503 for a render that does not fit the memory budget (or this worker's headroom)"""
+    response = jsonify({
+        'error': 'Render does not fit the memory budget' if retry_after is None else 'Worker memory exhausted, please retry',
+        'render_budget_mb': MEMORY_RENDER_BUDGET_MB
+    })
+    response.status_code = 503
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def process_alive(pid):
+    """Whether a process with this pid exists on the host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class RenderScheduler:
+    """Shares the host's render slots between the interactive and bulk lanes
+    
+    Slots and waiting renders live in a local SQLite database shared by all
+    gunicorn workers. Bulk renders never take the INTERACTIVE_RESERVED_SLOTS, and
+    while both lanes have renders waiting the next free slot goes to the lane
+    furthest below its weighted share; within a lane renders start in arrival
+    order. Every row holds a lease (a waiter's timeout, RUNNING_LEASE for a
+    running render); rows whose lease expired are ignored, and those and rows
+    whose process died are purged every PURGE_INTERVAL, so a crashed worker
+    never blocks a lane for long. Waiters wake at once when a slot is released
+    in their own process and otherwise poll with a backoff.
+    """
+    LANES = ('interactive', 'bulk')
+    # A running render older than this was abandoned (gunicorn kills workers long before)
+    RUNNING_LEASE = 600
+    # Seconds between purges of dead and expired rows, and the longest pause between polls
+    PURGE_INTERVAL = 1.0
+    MAX_POLL_INTERVAL = 0.25
+
+    def __init__(self, path, slots, reserved, weights, poll_interval):
+        # Bulk needs at least one slot to progress and interactive at least one of its own
+        if not 0 < reserved < slots:
+            raise ValueError(
+                f'INTERACTIVE_RESERVED_SLOTS ({reserved}) must be at least 1 and below SCHEDULER_SLOTS ({slots})'
+            )
+        self.path = path
+        self.slots = slots
+        self.reserved = reserved
+        self.bulk_limit = slots - reserved
+        self.weights = weights
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        # Signalled whenever a slot held in this process is released
+        self.released = threading.Condition()
+        self.last_purge = 0.0
+        self.stats = {lane: {'granted': 0, 'timed_out': 0, 'wait_seconds': 0.0} for lane in self.LANES}
+        with closing(self.connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Slots are transient, so a table from before leases were added is simply rebuilt
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(slots)')]
+            if columns and 'expires_at' not in columns:
+                conn.execute('DROP TABLE slots')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS slots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pid INTEGER NOT NULL,
+                    lane TEXT NOT NULL,
+                    cost REAL NOT NULL,
+                    state TEXT NOT NULL,
+                    queued_at REAL NOT NULL,
+                    started_at REAL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+        self.purge()
+    
+    def connect(self):
+        """Open a connection; one per call keeps the scheduler safe to use from any thread"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def acquire(self, lane, cost, timeout):
+        """Wait for a slot in the given lane and return its token, or None if timeout seconds pass first"""
+        started = time.monotonic()
+        now = time.time()
+        with closing(self.connect()) as conn:
+            token = conn.execute(
+                "INSERT INTO slots (pid, lane, cost, state, queued_at, expires_at) VALUES (?, ?, ?, 'waiting', ?, ?)",
+                (os.getpid(), lane, cost, now, now + timeout)
+            ).lastrowid
+        interval = self.poll_interval
+        try:
+            while True:
+                self.purge_if_due()
+                if self._try_start(token, lane):
+                    break
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.release(token)
+                    with self.lock:
+                        self.stats[lane]['timed_out'] += 1
+                    return None
+                with self.released:
+                    self.released.wait(min(interval, remaining))
+                interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+        except BaseException:
+            self.release(token)
+            raise
+        
+        waited = time.monotonic() - started
+        SLOT_WAIT_SECONDS.labels(lane).observe(waited)
+        with self.lock:
+            self.stats[lane]['granted'] += 1
+            self.stats[lane]['wait_seconds'] += waited
+        return token
+    
+    def _try_start(self, token, lane):
+        """Move a waiting render to running if it is next in its lane and the lane may start one"""
+        conn = self.connect()
+        try:
+            # Check without the write lock first, so renders that must keep waiting never contend for it
+            if not self._startable(conn, token, lane):
+                return False
+            conn.execute('BEGIN IMMEDIATE')
+            startable = self._startable(conn, token, lane)
+            if startable:
+                now = time.time()
+                conn.execute(
+                    "UPDATE slots SET state = 'running', started_at = ?, expires_at = ? WHERE id = ?",
+                    (now, now + self.RUNNING_LEASE, token)
+                )
+            conn.execute('COMMIT')
+            return startable
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def _startable(self, conn, token, lane):
+        running = dict.fromkeys(self.LANES, 0)
+        first_waiting = {}
+        # Rows whose lease ran out count for nothing, even before they are purged
+        rows = conn.execute(
+            'SELECT lane, state, COUNT(*) AS renders, MIN(id) AS first FROM slots WHERE expires_at >= ? GROUP BY lane, state',
+            (time.time(),)
+        )
+        for row in rows:
+            if row['state'] == 'running':
+                running[row['lane']] = row['renders']
+            else:
+                first_waiting[row['lane']] = row['first']
+        return first_waiting.get(lane) == token and self._may_start(lane, running, first_waiting)
+    
+    def _may_start(self, lane, running, first_waiting):
+        if sum(running.values()) >= self.slots:
+            return False
+        if lane == 'bulk' and running['bulk'] >= self.bulk_limit:
+            return False
+        other = 'bulk' if lane == 'interactive' else 'interactive'
+        other_blocked = other == 'bulk' and running['bulk'] >= self.bulk_limit
+        if other not in first_waiting or other_blocked:
+            return True
+        # Both lanes are waiting: the lane using less of its weighted share goes first
+        return running[lane] / self.weights[lane] <= running[other] / self.weights[other]
+    
+    def release(self, token):
+        """Free a slot (or give up waiting for one)"""
+        with closing(self.connect()) as conn:
+            conn.execute('DELETE FROM slots WHERE id = ?', (token,))
+        with self.released:
+            self.released.notify_all()
+    
+    def load(self):
+        """Return running and waiting renders, and the CPU seconds of work they have left, per lane"""
+        now = time.time()
+        load = {lane: {'running': 0, 'waiting': 0, 'backlog': 0.0} for lane in self.LANES}
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                '''SELECT lane, state, COUNT(*) AS renders,
+                          SUM(CASE WHEN state = 'running' THEN MAX(cost - (? - started_at), 0) ELSE cost END) AS backlog
+                   FROM slots WHERE expires_at >= ? GROUP BY lane, state''',
+                (now, now)
+            ).fetchall()
+        for row in rows:
+            if row['lane'] in load:
+                load[row['lane']][row['state']] = row['renders']
+                load[row['lane']]['backlog'] += row['backlog'] or 0.0
+        return load
+    
+    def lane_slots(self, lane, load):
+        """Return the slots a lane gets with the other lane idle, and the slots it can expect at this load"""
+        limit = self.slots if lane == 'interactive' else self.bulk_limit
+        other = 'bulk' if lane == 'interactive' else 'interactive'
+        other_demand = load[other]['running'] + load[other]['waiting']
+        share = self.slots * self.weights[lane] / sum(self.weights.values())
+        if lane == 'interactive':
+            share = max(share, self.reserved)
+        expected = min(limit, max(share, self.slots - other_demand))
+        return limit, max(expected, 1.0)
+    
+    def purge_if_due(self):
+        """Purge unless this process already did within PURGE_INTERVAL"""
+        with self.lock:
+            if time.monotonic() - self.last_purge < self.PURGE_INTERVAL:
+                return
+            self.last_purge = time.monotonic()
+        self.purge()
+    
+    def purge(self):
+        """Delete rows whose lease expired or whose process no longer exists
+        
+        Only takes the write lock when there is something to delete.
+        """
+        now = time.time()
+        with closing(self.connect()) as conn:
+            dead = [row['pid'] for row in conn.execute('SELECT DISTINCT pid FROM slots').fetchall() if not process_alive(row['pid'])]
+            expired = conn.execute('SELECT 1 FROM slots WHERE expires_at < ? LIMIT 1', (now,)).fetchone()
+            if dead or expired:
+                conn.execute(
+                    f"DELETE FROM slots WHERE expires_at < ? OR pid IN ({', '.join('?' * len(dead))})",
+                    (now, *dead)
+                )
+    
+    def get_stats(self):
+        """Return each lane's shared load and this process's grant counters"""
+        load = self.load()
+        with self.lock:
+            stats = {lane: dict(self.stats[lane], **load[lane]) for lane in self.LANES}
+        for lane in self.LANES:
+            stats[lane]['wait_seconds'] = round(stats[lane]['wait_seconds'], 3)
+            stats[lane]['backlog'] = round(stats[lane]['backlog'], 2)
+        stats.update({
+            'slots': self.slots,
+            'interactive_reserved': self.reserved,
+            'bulk_limit': self.bulk_limit,
+            'weights': self.weights
+        })
+        return stats
+
+render_scheduler = RenderScheduler(
+    SCHEDULER_DB_PATH, SCHEDULER_SLOTS, INTERACTIVE_RESERVED_SLOTS,
+    {'interactive': INTERACTIVE_WEIGHT, 'bulk': BULK_WEIGHT}, SCHEDULER_POLL_INTERVAL
+)
+
+class AdmissionController:
+    """Admit synchronous renders only when they can finish before the request deadline
+    
+    Renders are costed in CPU seconds from their product count and e-invoice/E-Way
+    Bill sections, scaled by how long recent renders in this process really took.
+    The wait is judged from the render scheduler's load in the request's own lane,
+    so a long bulk backlog never sheds interactive requests.
+    """
+    # Weight of each measured render in the cost calibration, and its bounds
+    CALIBRATION_WEIGHT = 0.1
+    CALIBRATION_BOUNDS = (0.2, 10.0)
+
+    def __init__(self, scheduler, deadline, max_backlog):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.max_backlog = max_backlog
+        self.calibration = 1.0
+        self.lock = threading.Lock()
+        self.stats = {'admitted': 0, 'overloaded': 0, 'deadline': 0, 'too_large': 0}
+    
+    def base_cost(self, items):
+        """Uncalibrated CPU seconds to lay out the given payloads"""
+        cost = 0.0
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            cost += RENDER_COST_BASE + RENDER_COST_PER_PRODUCT * len(item.get('products') or [])
+            for flag, extra in (('is_einvoice', RENDER_COST_EINVOICE), ('is_ewaybill', RENDER_COST_EWAYBILL)):
+                if str(item.get(flag)).lower() in ('true', 'yes', '1'):
+                    cost += extra
+        return cost
+    
+    def estimate(self, items):
+        """Estimate the CPU seconds needed to render the given payloads to PDF"""
+        with self.lock:
+            return self.base_cost(items) * self.calibration
+    
+    def calibrate(self, items, seconds):
+        """Move the calibration towards the ratio of a measured render time to its base cost"""
+        cost = self.base_cost(items)
+        if cost <= 0:
+            return
+        low, high = self.CALIBRATION_BOUNDS
+        with self.lock:
+            self.calibration += self.CALIBRATION_WEIGHT * (seconds / cost - self.calibration)
+            self.calibration = min(max(self.calibration, low), high)
+    
+    def admit(self, items, lane='interactive', parallelism=1, hold=True, streamed=False):
+        """Decide whether a render spread over parallelism processes can meet the deadline
+        
+        With hold, also wait (within the deadline) for its scheduler slot. A streamed
+        render only has to deliver its first item by the deadline, as the rest follow
+        while the response is being sent. Returns (token, None) when admitted, token
+        being None without hold, or (None, (reason, retry_after)) where reason is
+        'too_large' (cannot meet the deadline even with the lane to itself),
+        'overloaded' (the lane's backlog is over ADMISSION_MAX_BACKLOG) or
+        'deadline' (cannot meet it at the lane's current load).
+        """
+        cost = self.estimate(items)
+        load = self.scheduler.load()
+        limit, expected = self.scheduler.lane_slots(lane, load)
+        if streamed:
+            first_cost, parallelism = self.estimate(items[:1]), 1
+        else:
+            first_cost = cost
+        if first_cost / min(parallelism, limit) > self.deadline:
+            return self._refuse('too_large', cost, None)
+        
+        wait = load[lane]['backlog'] / expected
+        duration = first_cost / min(parallelism, expected)
+        if wait > self.max_backlog:
+            return self._refuse('overloaded', cost, wait - self.max_backlog)
+        if wait + duration > self.deadline:
+            return self._refuse('deadline', cost, wait)
+        
+        token = None
+        if hold:
+            token = self.scheduler.acquire(lane, cost, timeout=self.deadline - duration)
+            if token is None:
+                return self._refuse('deadline', cost, wait)
+        with self.lock:
+            self.stats['admitted'] += 1
+        return token, None
+    
+    def _refuse(self, reason, cost, wait):
+        retry_after = None if wait is None else max(1, math.ceil(wait))
+        with self.lock:
+            self.stats[reason] += 1
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        logger.warning("Render refused by admission control (%s): estimated %.1fs CPU", reason, cost)
+        return None, (reason, retry_after)
+    
+    def get_stats(self):
+        """Return this process's admission counters, cost calibration and limits"""
+        with self.lock:
+            stats = dict(self.stats, calibration=round(self.calibration, 3))
+        stats.update({'deadline_seconds': self.deadline, 'max_backlog_seconds': self.max_backlog})
+        return stats
+
+admission_control = AdmissionController(render_scheduler, ADMISSION_DEADLINE, ADMISSION_MAX_BACKLOG)
+
+def admission_rejection(reason, retry_after):
+    """Answer a refused render: 429 while the backlog drains, 503 when the deadline cannot be met"""
+    if reason == 'too_large' and request.endpoint == 'generate_invoices':
+        message = 'Batch cannot finish within the request deadline, request format=zip to stream it or split the batch'
+    elif reason == 'too_large':
+        message = 'Render cannot finish within the request deadline, submit it with ?async=1'
+    elif reason == 'overloaded':
+        message = 'Too many renders in progress, please retry'
+    else:
+        message = 'Server too busy to finish this render in time, please retry'
+    response = jsonify({'error': message, 'deadline_seconds': ADMISSION_DEADLINE})
+    response.status_code = 429 if reason == 'overloaded' else 503
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def slot_rejection(lane):
+    """Answer 503 when no scheduler slot freed up in time, retrying once the lane's backlog has drained"""
+    load = render_scheduler.load()
+    _, expected = render_scheduler.lane_slots(lane, load)
+    return admission_rejection('deadline', max(1, math.ceil(load[lane]['backlog'] / expected)))
+
+def admit_render(items, lane='interactive', parallelism=1, hold=True, streamed=False):
+    """Admit a synchronous render, holding a scheduler slot until the response is sent unless hold is off
+    
+    Returns None when admitted, otherwise the refusal response.
+    """
+    if ADMISSION_ENABLED:
+        token, refusal = admission_control.admit(items, lane, parallelism, hold, streamed)
+        if refusal is not None:
+            return admission_rejection(*refusal)
+    elif hold:
+        token = render_scheduler.acquire(lane, admission_control.estimate(items), ADMISSION_DEADLINE)
+        if token is None:
+            return slot_rejection(lane)
+    if hold:
+        g.setdefault('slot_tokens', []).append(token)
+    return None
+
+def release_slots(tokens):
+    """Release scheduler slots held by admit_render"""
+    for token in tokens:
+        render_scheduler.release(token)
+
+@app.after_request
+def hold_slots_until_sent(response):
+    """Keep this request's scheduler slots until its response has been sent"""
+    tokens = g.pop('slot_tokens', None)
+    if tokens:
+        response.call_on_close(lambda: release_slots(tokens))
+    return response
+
+@app.teardown_request
+def release_request_slots(exc):
+    """Release slots still held by a request that failed before producing a response"""
+    release_slots(g.pop('slot_tokens', []))
+
+def admit_pdf_render(pipeline):
+    """Refuse a PDF render over the memory budget or the deadline, asking for a retry when this worker lacks headroom
+    
+    Cached documents cost nothing to serve and are always admitted.
+    """
+    data = pipeline.data
+    if render_cache.contains(render_cache_key(pipeline, 'pdf')):
+        return None
+    verdict = memory_governor.admit([data])
+    if verdict != 'ok':
+        return memory_rejection(retry_after=None if verdict == 'reject' else 1)
+    return admit_render([data])
+
+@app.route('/generate-invoice', methods=['POST'])
+@idempotent
+def generate_invoice():
+    """API endpoint to generate regular invoice"""
+    try:
+        logger.info("Received invoice generation request from %s", request.remote_addr)
+        
+        # Get JSON data from request
+        with observe_stage('json_parse'):
+            invoice_data = request.get_json()
+        
+        if not invoice_data:
+            logger.error("No JSON data provided in request")
+            return jsonify({'error': 'No JSON data provided'}), 400
+        
+        # Validate the data (a payload that is not an object is refused here too)
+        try:
+            with observe_stage('validation'):
+                pipeline = RenderPipeline(invoice_generator, invoice_data, kind='invoice')
+                pipeline.validate()
+            logger.info("Invoice data validation successful: %s", invoice_data.get('invoice_number', 'Unknown'))
+        except ValueError as ve:
+            logger.error("Validation error: %s", ve)
+            return jsonify({
+                'error': f'Validation error: {str(ve)}',
+                'details': getattr(ve, 'errors', [str(ve)])
+            }), 400
+        
+        # Get output format (html or pdf)
+        output_format = request.args.get('format', 'html').lower()
+        logger.info("Output format requested: %s", output_format)
+        
+        # Hand the render to the background job queue when requested
+        if wants_async():
+            return enqueue_render_job('invoice', invoice_data, output_format)
+        
+        if output_format == 'pdf':
+            rejection = admit_pdf_render(pipeline)
+            if rejection is not None:
+                return rejection
+        
+        if output_format == 'pdf':
+            try:
+                # Generate PDF using WeasyPrint
+                logger.info("Starting PDF generation with WeasyPrint...")
+                pdf_bytes, cache_hit = render_with_cache(pipeline, 'pdf')
+                logger.info("PDF %s, size: %s bytes", 'served from cache' if cache_hit else 'generated successfully', len(pdf_bytes))
+                
+                # Create response
+                response = Response(pdf_bytes, mimetype='application/pdf')
+                response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+                response.headers['Content-Disposition'] = f'attachment; filename=invoice_{invoice_data["invoice_number"]}.pdf'
+                logger.info("PDF response prepared successfully")
                 return response
                 
             except Exception as pdf_error:
-                logger.error(f"PDF generation failed: {str(pdf_error)}")
-                logger.error(traceback.format_exc())
+                logger.error("PDF generation failed: %s", pdf_error)
                 
                 # Fallback to HTML if PDF fails
                 logger.info("Falling back to HTML generation...")
+                HTML_FALLBACKS.labels('generate_invoice').inc()
                 try:
-                    html_content = invoice_generator.generate_html(invoice_data)
+                    # Reuses the HTML the failed PDF attempt already rendered
+                    html_content = pipeline.html()
                     return jsonify({
                         'error': 'PDF generation failed, HTML fallback provided',
                         'pdf_error': str(pdf_error),
                         'html_content': html_content
                     }), 500
                 except Exception as html_error:
-                    logger.error(f"HTML fallback also failed: {str(html_error)}")
+                    logger.error("HTML fallback also failed: %s", html_error)
                     return jsonify({
                         'error': 'Both PDF and HTML generation failed',
                         'pdf_error': str(pdf_error),
@@ -887,80 +3541,98 @@ def generate_invoice():
         
         else:
             try:
+                # Stream large invoices chunk by chunk when requested, enriched before the 200 goes out
+                if wants_stream():
+                    logger.info("Streaming HTML...")
+                    pipeline.enrich()
+                    return Response(stream_with_context(invoice_generator.stream_html(pipeline.data)), mimetype='text/html')
+                
                 # Generate HTML
                 logger.info("Generating HTML...")
-                html_content = invoice_generator.generate_html(invoice_data)
+                html_content, cache_hit = render_with_cache(pipeline, 'html')
                 logger.info("HTML generated successfully")
-                return html_content, 200, {'Content-Type': 'text/html'}
+                return html_content, 200, {'Content-Type': 'text/html', 'X-Cache': 'HIT' if cache_hit else 'MISS'}
             except Exception as html_error:
-                logger.error(f"HTML generation failed: {str(html_error)}")
+                logger.error("HTML generation failed: %s", html_error)
                 return jsonify({'error': f'HTML generation failed: {str(html_error)}'}), 500
             
     except Exception as e:
-        logger.error(f"Unexpected error in generate_invoice: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Unexpected error in generate_invoice: %s", e)
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @app.route('/generate-ewaybill', methods=['POST'])
+@idempotent
 def generate_ewaybill():
     """API endpoint to generate E-Way Bill with transport details"""
     try:
-        logger.info(f"Received E-Way Bill generation request from {request.remote_addr}")
+        logger.info("Received E-Way Bill generation request from %s", request.remote_addr)
         
         # Get JSON data from request
-        ewaybill_data = request.get_json()
+        with observe_stage('json_parse'):
+            ewaybill_data = request.get_json()
         
         if not ewaybill_data:
             logger.error("No JSON data provided in E-Way Bill request")
             return jsonify({'error': 'No JSON data provided'}), 400
         
-        # Set E-Way Bill specific flags
-        ewaybill_data['is_ewaybill'] = True
-        ewaybill_data['invoice_type'] = ewaybill_data.get('invoice_type', 'TAX INVOICE WITH E-WAY BILL')
-        ewaybill_data['document_type'] = ewaybill_data.get('document_type', 'ORIGINAL FOR CONSIGNEE')
-        
-        logger.info(f"Processing E-Way Bill: {ewaybill_data.get('ewb_number', 'Unknown')}")
+        # Staged render; validation also sets the E-Way Bill flags and document defaults
+        pipeline = RenderPipeline(invoice_generator, ewaybill_data, kind='ewaybill')
         
-        # Validate the data
+        # Validate the data (a payload that is not an object is refused here too)
         try:
-            invoice_generator.validate_ewaybill_data(ewaybill_data)
-            logger.info("E-Way Bill data validation successful")
+            with observe_stage('validation'):
+                pipeline.validate()
+            logger.info("E-Way Bill data validation successful: %s", ewaybill_data.get('ewb_number', 'Unknown'))
         except ValueError as ve:
-            logger.error(f"E-Way Bill validation error: {str(ve)}")
-            return jsonify({'error': f'Validation error: {str(ve)}'}), 400
+            logger.error("E-Way Bill validation error: %s", ve)
+            return jsonify({
+                'error': f'Validation error: {str(ve)}',
+                'details': getattr(ve, 'errors', [str(ve)])
+            }), 400
         
         # Get output format (html or pdf)
         output_format = request.args.get('format', 'html').lower()
-        logger.info(f"E-Way Bill output format requested: {output_format}")
+        logger.info("E-Way Bill output format requested: %s", output_format)
+        
+        # Hand the render to the background job queue when requested
+        if wants_async():
+            return enqueue_render_job('ewaybill', ewaybill_data, output_format)
+        
+        if output_format == 'pdf':
+            rejection = admit_pdf_render(pipeline)
+            if rejection is not None:
+                return rejection
         
         if output_format == 'pdf':
             try:
                 # Generate PDF
                 logger.info("Starting E-Way Bill PDF generation with WeasyPrint...")
-                pdf_bytes = invoice_generator.generate_pdf(ewaybill_data)
-                logger.info(f"E-Way Bill PDF generated successfully, size: {len(pdf_bytes)} bytes")
+                pdf_bytes, cache_hit = render_with_cache(pipeline, 'pdf')
+                logger.info("E-Way Bill PDF %s, size: %s bytes", 'served from cache' if cache_hit else 'generated successfully', len(pdf_bytes))
                 
                 # Create response
                 response = Response(pdf_bytes, mimetype='application/pdf')
+                response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
                 response.headers['Content-Disposition'] = f'attachment; filename=ewaybill_{ewaybill_data["ewb_number"]}.pdf'
                 logger.info("E-Way Bill PDF response prepared successfully")
                 return response
                 
             except Exception as pdf_error:
-                logger.error(f"E-Way Bill PDF generation failed: {str(pdf_error)}")
-                logger.error(traceback.format_exc())
+                logger.error("E-Way Bill PDF generation failed: %s", pdf_error)
                 
                 # Fallback to HTML if PDF fails
                 logger.info("Falling back to HTML generation for E-Way Bill...")
+                HTML_FALLBACKS.labels('generate_ewaybill').inc()
                 try:
-                    html_content = invoice_generator.generate_html(ewaybill_data)
+                    # Reuses the HTML the failed PDF attempt already rendered
+                    html_content = pipeline.html()
                     return jsonify({
                         'error': 'E-Way Bill PDF generation failed, HTML fallback provided',
                         'pdf_error': str(pdf_error),
                         'html_content': html_content
                     }), 500
                 except Exception as html_error:
-                    logger.error(f"E-Way Bill HTML fallback also failed: {str(html_error)}")
+                    logger.error("E-Way Bill HTML fallback also failed: %s", html_error)
                     return jsonify({
                         'error': 'Both E-Way Bill PDF and HTML generation failed',
                         'pdf_error': str(pdf_error),
@@ -969,20 +3641,203 @@ def generate_ewaybill():
         
         else:
             try:
+                # Stream large E-Way Bills chunk by chunk when requested, enriched before the 200 goes out
+                if wants_stream():
+                    logger.info("Streaming E-Way Bill HTML...")
+                    pipeline.enrich()
+                    return Response(stream_with_context(invoice_generator.stream_html(pipeline.data)), mimetype='text/html')
+                
                 # Generate HTML
                 logger.info("Generating E-Way Bill HTML...")
-                html_content = invoice_generator.generate_html(ewaybill_data)
+                html_content, cache_hit = render_with_cache(pipeline, 'html')
                 logger.info("E-Way Bill HTML generated successfully")
-                return html_content, 200, {'Content-Type': 'text/html'}
+                return html_content, 200, {'Content-Type': 'text/html', 'X-Cache': 'HIT' if cache_hit else 'MISS'}
             except Exception as html_error:
-                logger.error(f"E-Way Bill HTML generation failed: {str(html_error)}")
+                logger.error("E-Way Bill HTML generation failed: %s", html_error)
                 return jsonify({'error': f'HTML generation failed: {str(html_error)}'}), 500
             
     except Exception as e:
-        logger.error(f"Unexpected error in generate_ewaybill: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Unexpected error in generate_ewaybill: %s", e)
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.route('/generate-invoices', methods=['POST'])
+def generate_invoices():
+    """API endpoint to render a batch of invoices (or E-Way Bills) to PDF
+
+    format=json (default) renders items in parallel and returns one PDF per item;
+    format=pdf lays out every item and returns a single combined PDF;
+    format=zip streams the per-item PDFs as a ZIP archive while they render.
+    """
+    try:
+        with observe_stage('json_parse'):
+            batch_data = request.get_json()
+        
+        # Accept either a bare array or {"invoices": [...]}
+        if isinstance(batch_data, dict):
+            batch_data = batch_data.get('invoices')
+        
+        if not isinstance(batch_data, list) or len(batch_data) == 0:
+            return jsonify({'error': 'Request body must be a non-empty array of invoices'}), 400
+        
+        if len(batch_data) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Batch too large: {len(batch_data)} items (max {BATCH_MAX_ITEMS})'}), 413
+        
+        # Get output format (json with one PDF per item, or a single combined pdf)
+        output_format = request.args.get('format', 'json').lower()
+        logger.info("Received batch of %s invoices from %s, format: %s", len(batch_data), request.remote_addr, output_format)
+        
+        if output_format == 'pdf':
+            errors = []
+            for index, item in enumerate(batch_data):
+                try:
+                    validate_batch_item(item)
+                except ValueError as ve:
+                    errors.append({'index': index, 'error': f'Validation error: {str(ve)}'})
+            if errors:
+                return jsonify({'error': 'Validation failed for some batch items', 'items': errors}), 400
+            
+            verdict = memory_governor.admit(batch_data)
+            if verdict != 'ok':
+                return memory_rejection(retry_after=None if verdict == 'reject' else 1)
+            # The combined document is laid out in this process, one item after another
+            rejection = admit_render(batch_data, lane='bulk')
+            if rejection is not None:
+                return rejection
+            
+            try:
+                pdf_bytes = invoice_generator.generate_combined_pdf(batch_data)
+                memory_governor.record_render()
+            except Exception as pdf_error:
+                logger.error("Combined PDF generation failed: %s", pdf_error)
+                return jsonify({'error': f'PDF generation failed: {str(pdf_error)}'}), 500
+            
+            response = Response(pdf_bytes, mimetype='application/pdf')
+            response.headers['Content-Disposition'] = f'attachment; filename=invoices_{len(batch_data)}.pdf'
+            return response
+        
+        # Per-item renders are spread over the batch pool's processes, each taking its own bulk slot.
+        # A ZIP is streamed as items finish, so only its first entry is held to the deadline
+        rejection = admit_render(
+            batch_data, lane='bulk', parallelism=min(BATCH_WORKERS, len(batch_data)), hold=False,
+            streamed=output_format == 'zip'
+        )
+        if rejection is not None:
+            return rejection
+        
+        if output_format == 'zip':
+            response = Response(stream_with_context(stream_batch_zip(batch_data)), mimetype='application/zip')
+            response.headers['Content-Disposition'] = f'attachment; filename=invoices_{len(batch_data)}.zip'
+            return response
+        
+        results = render_batch(batch_data)
+        
+        for index, result in enumerate(results):
+            result['index'] = index
+        failed = sum(1 for result in results if result['status'] != 'success')
+        logger.info("Batch completed: %s succeeded, %s failed", len(results) - failed, failed)
+        
+        return jsonify({
+            'count': len(results),
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'results': results
+        })
+        
+    except SlotTimeout as e:
+        logger.warning("Batch refused: %s", e)
+        return slot_rejection('bulk')
+    except Exception as e:
+        logger.exception("Unexpected error in generate_invoices: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+def job_filename(job):
+    """Build the download filename for a finished job"""
+    extension = 'pdf' if job['output_format'] == 'pdf' else 'html'
+    return f"{job['kind']}_{job['id']}.{extension}"
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Return the status of an async render job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    job_info = {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'format': job['output_format'],
+        'status': job['status'],
+        'attempts': job['attempts']
+    }
+    for field in ('created_at', 'started_at', 'finished_at'):
+        if job[field]:
+            job_info[field] = datetime.fromtimestamp(job[field]).isoformat()
+    if job['status'] == 'done':
+        job_info['result_url'] = f'/jobs/{job_id}/result'
+    if job['status'] == 'failed':
+        job_info['error'] = job['error']
+    
+    return jsonify(job_info)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Download the rendered document of a finished async job"""
+    job = job_queue.get(job_id, with_result=True)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+    
+    if job['output_format'] == 'pdf':
+        response = Response(job['result'], mimetype='application/pdf')
+        response.headers['Content-Disposition'] = f'attachment; filename={job_filename(job)}'
+        return response
+    return job['result'], 200, {'Content-Type': 'text/html'}
+
+@app.before_request
+def start_request_timer():
+    """Remember when the request started for the Server-Timing total"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def add_server_timing(response):
+    """Report per-stage durations in a Server-Timing header (and JSON error bodies on request)"""
+    timings = g.get('stage_timings', {})
+    if 'request_started' in g:
+        timings = dict(timings, total=time.perf_counter() - g.request_started)
+    if not timings:
+        return response
+    
+    response.headers['Server-Timing'] = ', '.join(
+        f'{stage};dur={duration * 1000:.1f}' for stage, duration in timings.items()
+    )
+    
+    wants_timing = TIMING_IN_ERRORS or request.args.get('timing', '').lower() in ('1', 'true', 'yes')
+    if wants_timing and response.status_code >= 400 and response.is_json:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body['timings_ms'] = {stage: round(duration * 1000, 1) for stage, duration in timings.items()}
+            response.set_data(json.dumps(body))
+    return response
+
+@app.after_request
+def count_request(response):
+    """Count every response by endpoint, requested format and status code"""
+    if request.endpoint != 'metrics':
+        # Keep label cardinality bounded whatever clients send
+        output_format = request.args.get('format', 'default').lower()
+        if output_format not in ('default', 'html', 'pdf', 'json', 'zip'):
+            output_format = 'other'
+        REQUEST_COUNT.labels(request.endpoint or 'unknown', output_format, str(response.status_code)).inc()
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics aggregated across all worker processes"""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint with system information"""
@@ -996,6 +3851,12 @@ def health_check():
             'python_version': sys.version,
             'platform': platform.platform(),
             'pdf_engine': 'WeasyPrint',
+            'render_cache': render_cache.get_stats(),
+            'startup': STARTUP_TIMINGS,
+            'memory': memory_governor.get_stats(),
+            'assets': asset_store.get_stats(),
+            'admission': admission_control.get_stats(),
+            'scheduler': render_scheduler.get_stats(),
             'environment_vars': {
                 'PORT': os.getenv('PORT', 'not set')
             }
@@ -1004,7 +3865,7 @@ def health_check():
         logger.info("Health check requested")
         return jsonify(health_info)
     except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
+        logger.error("Health check failed: %s", e)
         return jsonify({
             'status': 'unhealthy',
             'error': str(e),
@@ -1018,30 +3879,17 @@ def debug_pdf():
         logger.info("PDF debug test initiated with WeasyPrint")
         
         # Test data
-        test_data = {
-            'invoice_number': 'TEST001',
-            'invoice_date': '01/01/2025',
-            'company_name': 'Test Company',
-            'customer_name': 'Test Customer',
-            'products': [{
-                'serial_no': 1,
-                'product_name': 'Test Product',
-                'hsn_code': '12345',
-                'mrp': '100',
-                'qty': '1',
-                'net_value': '100'
-            }],
-            'net_receivable': '100'
-        }
+        test_data = copy.deepcopy(SAMPLE_INVOICE)
         
         try:
-            # Try to generate HTML first
-            html_content = invoice_generator.generate_html(test_data)
+            # Try to generate HTML first; the PDF then lays out the same render
+            pipeline = RenderPipeline(invoice_generator, test_data)
+            html_content = pipeline.html()
             logger.info("HTML generation test successful")
             
             # Try to generate PDF with WeasyPrint
-            pdf_bytes = invoice_generator.generate_pdf(test_data)
-            logger.info(f"PDF generation test successful with WeasyPrint, size: {len(pdf_bytes)} bytes")
+            pdf_bytes = pipeline.pdf()
+            logger.info("PDF generation test successful with WeasyPrint, size: %s bytes", len(pdf_bytes))
             
             return jsonify({
                 'status': 'success',
@@ -1052,7 +3900,7 @@ def debug_pdf():
             })
             
         except Exception as test_error:
-            logger.error(f"PDF debug test failed: {str(test_error)}")
+            logger.error("PDF debug test failed: %s", test_error)
             return jsonify({
                 'status': 'failed',
                 'error': str(test_error),
@@ -1060,178 +3908,267 @@ def debug_pdf():
             }), 500
             
     except Exception as e:
-        logger.error(f"Debug endpoint error: {str(e)}")
+        logger.error("Debug endpoint error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/template-schema', methods=['GET'])
 def get_template_schema():
     """Get the JSON schema for invoice template"""
-    schema = {
-        "invoice_number": "string - Invoice number",
-        "invoice_date": "string - Invoice date (DD/MM/YYYY)",
-        "invoice_type": "string - Type of invoice (default: TAX INVOICE)",
-        "document_type": "string - Document type (e.g., ORIGINAL FOR RECIPIENT)",
+    return jsonify(TEMPLATE_SCHEMA)
+
+@app.route('/ewaybill-schema', methods=['GET'])
+def get_ewaybill_schema():
+    """Get specific schema for E-Way Bill with transport details"""
+    return jsonify(EWAYBILL_SCHEMA)
+
+def company_profile_info(profile_id, stored):
+    """Describe a stored company profile for API responses"""
+    return {
+        'profile_id': profile_id,
+        'profile': stored['profile'],
+        'updated_at': datetime.fromtimestamp(stored['updated_at']).isoformat()
+    }
+
+@app.route('/company-profiles/<profile_id>', methods=['PUT'])
+def put_company_profile(profile_id):
+    """Register (or replace) a company profile and pre-render its header and footer fragments"""
+    try:
+        if len(profile_id) > MAX_PROFILE_ID_LENGTH:
+            return jsonify({'error': f'Profile ID too long (max {MAX_PROFILE_ID_LENGTH} characters)'}), 400
         
-        # E-Invoice specific fields
-        "is_einvoice": "boolean - Whether this is an E-Invoice",
-        "irn_number": "string - IRN number for E-Invoice",
-        "ack_no": "string - Acknowledgement number",
-        "ack_date": "string - Acknowledgement date",
-        "einvoice_status": "string - E-Invoice status (GENERATED, PENDING, FAILED)",
-        "show_qr_code": "boolean - Whether to show QR code",
-        "qr_code_data": "string - QR code data content",
-        "government_portal": "string - Government portal URL",
-        "einvoice_compliance_note": "string - Compliance note for E-Invoice",
+        profile = request.get_json(silent=True)
+        if not isinstance(profile, dict) or not profile:
+            return jsonify({'error': 'Request body must be a JSON object of company fields'}), 400
         
-        # E-Way Bill specific fields
-        "is_ewaybill": "boolean - Whether this is an E-Way Bill",
-        "ewb_number": "string - E-Way Bill number",
-        "ewb_date": "string - E-Way Bill generation date",
-        "ewb_valid_until": "string - E-Way Bill validity date",
-        "ewaybill_status": "string - E-Way Bill status (GENERATED, PENDING, FAILED)",
-        "ewaybill_compliance_note": "string - Compliance note for E-Way Bill",
+        unknown_fields = sorted(set(profile) - set(COMPANY_PROFILE_FIELDS))
+        if unknown_fields:
+            return jsonify({
+                'error': f"Unknown company profile fields: {', '.join(unknown_fields)}",
+                'allowed_fields': list(COMPANY_PROFILE_FIELDS)
+            }), 400
         
-        # Transport details for E-Way Bill
-        "transporter_name": "string - Transporter name",
-        "transporter_id": "string - Transporter ID/GSTIN",
-        "vehicle_number": "string - Vehicle registration number",
-        "driver_name": "string - Driver name",
-        "driver_mobile": "string - Driver mobile number",
-        "transport_distance": "string - Transport distance in KM",
-        "transport_mode": "string - Mode of transport (Road/Rail/Air/Ship)",
-        "from_place": "string - Origin place",
-        "from_pincode": "string - Origin pincode",
-        "to_place": "string - Destination place",
-        "to_pincode": "string - Destination pincode",
-        "has_extensions": "boolean - Whether E-Way Bill has extensions",
-        "extension_count": "number - Number of extensions applied",
+        try:
+            profile_validator.validate(profile)
+            validate_asset_references(profile)
+        except ValueError as ve:
+            return jsonify({
+                'error': f'Validation error: {str(ve)}',
+                'details': getattr(ve, 'errors', [str(ve)])
+            }), 400
         
-        # Company and customer details
-        "company_name": "string - Company name (required)",
-        "company_address": "string - Company address",
-        "company_city": "string - Company city",
-        "company_gstin": "string - Company GSTIN",
-        "company_pan": "string - Company PAN",
-        "company_fssai": "string - Company FSSAI license",
-        "company_gst_state": "string - Company GST state",
-        "company_state_code": "string - Company state code",
-        "sm_name": "string - Sales manager name",
-        "beat_name": "string - Beat name",
-        "sm_contact": "string - Sales manager contact",
-        "sm_mobile": "string - Sales manager mobile",
-        "customer_name": "string - Customer name (required)",
-        "customer_address": "string - Customer address",
-        "retailer_code": "string - Retailer code",
-        "po_so_ref": "string - PO/SO reference",
-        "customer_pan": "string - Customer PAN",
-        "customer_gstin": "string - Customer GSTIN",
-        "payment_mode": "string - Payment mode",
-        "customer_contact": "string - Customer contact",
-        "drug_license": "string - Drug license number",
-        "customer_fssai": "string - Customer FSSAI",
-        "customer_gst_state": "string - Customer GST state",
-        "customer_state_code": "string - Customer state code",
-        "vehicle": "string - Vehicle information",
+        fragments = invoice_generator.render_company_fragments(profile)
+        created = company_profiles.save(profile_id, profile, fragments)
+        logger.info("Company profile %s %s", profile_id, 'registered' if created else 'updated')
+        return jsonify(company_profile_info(profile_id, company_profiles.get(profile_id))), 201 if created else 200
         
-        # Product details (required)
-        "products": [
-            {
-                "serial_no": "number - Serial number",
-                "hsn_code": "string - HSN code",
-                "product_name": "string - Product name",
-                "mrp": "string - MRP",
-                "cs": "string - Cases",
-                "qty": "string - Quantity",
-                "free": "string - Free quantity",
-                "upc": "string - UPC",
-                "gross_rate": "string - Gross rate",
-                "total": "string - Total amount",
-                "pri_disc": "string - Primary discount",
-                "sec_disc": "string - Secondary discount",
-                "lnd_disc": "string - L&D discount",
-                "taxable_amt": "string - Taxable amount",
-                "cgst_rate": "string - CGST rate",
-                "cgst_amt": "string - CGST amount",
-                "sgst_rate": "string - SGST rate",
-                "sgst_amt": "string - SGST amount",
-                "net_rate": "string - Net rate",
-                "net_value": "string - Net value"
-            }
-        ],
+    except Exception as e:
+        logger.exception("Unexpected error in put_company_profile: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/company-profiles/<profile_id>', methods=['GET'])
+def get_company_profile(profile_id):
+    """Return a registered company profile"""
+    stored = company_profiles.get(profile_id)
+    if stored is None:
+        return jsonify({'error': 'Company profile not found'}), 404
+    return jsonify(company_profile_info(profile_id, stored))
+
+@app.route('/company-profiles/<profile_id>', methods=['DELETE'])
+def delete_company_profile(profile_id):
+    """Remove a registered company profile"""
+    if not company_profiles.delete(profile_id):
+        return jsonify({'error': 'Company profile not found'}), 404
+    logger.info("Company profile %s deleted", profile_id)
+    return '', 204
+
+@app.route('/assets/<name>', methods=['PUT'])
+def put_asset(name):
+    """Upload a logo or signature image (raw request body) under a new, immutable name"""
+    try:
+        content = request.get_data()
+        if not content:
+            return jsonify({'error': 'Request body must be the image file'}), 400
+        if len(content) > ASSET_MAX_UPLOAD_BYTES:
+            return jsonify({'error': f'Asset too large (max {ASSET_MAX_UPLOAD_BYTES} bytes)'}), 413
         
-        # Summary totals
-        "total_items": "string - Total number of items",
-        "total_cs": "string - Total cases",
-        "total_qty": "string - Total quantity",
-        "total_free": "string - Total free quantity",
-        "grand_total": "string - Grand total",
-        "total_pri_disc": "string - Total primary discount",
-        "total_sec_disc": "string - Total secondary discount",
-        "total_lnd_disc": "string - Total L&D discount",
-        "total_taxable_amt": "string - Total taxable amount",
-        "total_cgst_amt": "string - Total CGST amount",
-        "total_sgst_amt": "string - Total SGST amount",
+        try:
+            created = asset_store.save(name, content)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        if not created:
+            return jsonify({'error': 'Asset already exists; upload changed images under a new name'}), 409
         
-        # Financial summary
-        "net_receivable": "string - Net receivable amount (required)",
-        "amount_in_words": "string - Amount in words",
-        "pre_tax_scheme_amt": "string - Pre-tax scheme amount",
-        "net_amount": "string - Net amount",
-        "total_cgst": "string - Total CGST",
-        "total_sgst": "string - Total SGST",
-        "cash_disc_deducted": "string - Cash discount deducted",
-        "tcs_tax_amt": "string - TCS tax amount",
-        "credit_adj": "string - Credit adjustment",
-        "round_off": "string - Round off amount",
+        logger.info("Asset %s uploaded, %s bytes", name, len(content))
+        return jsonify({'name': name, 'size': len(content), 'url': f'asset:{name}', 'href': f'/assets/{name}'}), 201
         
-        # Footer details
-        "reverse_charge_basis": "string - Reverse charge basis (Yes/No)",
-        "return_policy_note": "string - Return policy note",
-        "jurisdiction": "string - Jurisdiction",
-        "bank_account_no": "string - Bank account number",
-        "bank_name": "string - Bank name",
-        "bank_ifsc": "string - Bank IFSC code"
-    }
-    
-    return jsonify(schema)
+    except Exception as e:
+        logger.exception("Unexpected error in put_asset: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/ewaybill-schema', methods=['GET'])
-def get_ewaybill_schema():
-    """Get specific schema for E-Way Bill with transport details"""
-    schema = {
-        "required_fields": [
-            "invoice_number",
-            "invoice_date", 
-            "company_name",
-            "customer_name",
-            "products",
-            "net_receivable",
-            "ewb_number"
-        ],
-        "ewaybill_specific": {
-            "ewb_number": "string - E-Way Bill number (required)",
-            "ewb_date": "string - E-Way Bill generation date",
-            "ewb_valid_until": "string - E-Way Bill validity end date/time",
-            "ewaybill_status": "string - Status: GENERATED/PENDING/FAILED",
-            "transporter_name": "string - Name of the transporter",
-            "transporter_id": "string - Transporter GSTIN or ID",
-            "vehicle_number": "string - Vehicle registration number",
-            "driver_name": "string - Driver's name",
-            "driver_mobile": "string - Driver's mobile number",
-            "transport_distance": "string - Distance in kilometers",
-            "transport_mode": "string - Road/Rail/Air/Ship",
-            "from_place": "string - Origin city/place",
-            "from_pincode": "string - Origin pincode",
-            "to_place": "string - Destination city/place", 
-            "to_pincode": "string - Destination pincode",
-            "has_extensions": "boolean - Whether validity was extended",
-            "extension_count": "number - Number of extensions applied"
-        },
-        "note": "WeasyPrint PDF engine provides better compatibility than Playwright"
-    }
+@app.route('/assets/<name>', methods=['GET'])
+def get_asset(name):
+    """Serve an uploaded image as prepared for print; names are immutable, so it caches forever"""
+    try:
+        content, mime_type = asset_store.load(name)
+    except (ValueError, OSError):
+        return jsonify({'error': 'Asset not found'}), 404
+    response = Response(content, mimetype=mime_type)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def warm_up():
+    """Pay one-off rendering costs up front: font discovery, Pango/HarfBuzz, stylesheet, QR encoder
+
+    Called by gunicorn.conf.py and before app.run(), never on import. Under gunicorn
+    with preload_app the warmed state is shared copy-on-write by every worker.
+    """
+    if not WARM_UP:
+        return
+    started = time.perf_counter()
+    try:
+        invoice_generator.get_stylesheet()
+        invoice_generator.generate_qr_code(SAMPLE_INVOICE['invoice_number'])
+        invoice_generator.generate_pdf(copy.deepcopy(SAMPLE_INVOICE))
+    except Exception as e:
+        logger.warning("Warm-up render failed, first request will pay the startup cost: %s", e)
+    STARTUP_TIMINGS['warmup_seconds'] = round(time.perf_counter() - started, 3)
+    STARTUP_TIMINGS['ready_seconds'] = round(time.perf_counter() - STARTUP_BEGAN, 3)
+    logger.info("Rendering stack warmed up", extra={'startup': STARTUP_TIMINGS})
+
+STARTUP_TIMINGS['import_seconds'] = round(time.perf_counter() - STARTUP_BEGAN, 3)
+
+def render_item_to_file(item, output_format, path):
+    """Validate and render one corpus item straight to a file inside a pool worker
+
+    Output is written to a temporary file and renamed, so an interrupted run
+    never leaves a partial document that a resumed run would skip. The render
+    cache is bypassed: archived corpora are rendered once, not served again.
+    """
+    invoice_number = item.get('invoice_number') if isinstance(item, dict) else None
+    try:
+        pipeline = validate_batch_item(item)
+        content = pipeline.pdf() if output_format == 'pdf' else pipeline.html().encode()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.partial')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return {'status': 'success', 'invoice_number': invoice_number, 'size': len(content)}
+    except ValueError as ve:
+        return {'status': 'failed', 'invoice_number': invoice_number, 'error': f'Validation error: {str(ve)}'}
+    except Exception as e:
+        return {'status': 'failed', 'invoice_number': invoice_number, 'error': str(e)}
+
+def read_corpus(path):
+    """Yield (line index, payload or parse error) for each non-blank line of a JSONL file"""
+    with open(path, encoding='utf-8') as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                yield index, json.loads(line)
+            except ValueError as e:
+                yield index, e
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'expected a positive whole number, got {value!r}')
+    return number
+
+def render_batch_cli(argv):
+    """Render a JSONL corpus to files on a local process pool, skipping outputs that already exist"""
+    parser = argparse.ArgumentParser(
+        prog='app.py render-batch',
+        description='Render every invoice or E-Way Bill in a JSONL file (one payload per line) without the HTTP service'
+    )
+    parser.add_argument('input', help='JSONL file with one payload per line')
+    parser.add_argument('outdir', help='directory for the rendered documents')
+    parser.add_argument('--workers', type=positive_int, default=os.cpu_count() or 1, help='render processes (default: all cores)')
+    parser.add_argument('--format', choices=('pdf', 'html'), default='pdf', help='output format (default: pdf)')
+    parser.add_argument('--force', action='store_true', help='re-render documents whose output already exists')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='seconds between progress lines')
+    args = parser.parse_args(argv)
+    
+    os.makedirs(args.outdir, exist_ok=True)
+    total = sum(1 for _ in read_corpus(args.input))
+    counts = {'success': 0, 'failed': 0, 'skipped': 0}
+    failures_path = os.path.join(args.outdir, 'render-batch-failures.jsonl')
+    started = last_report = time.perf_counter()
+    
+    def report(final=False):
+        finished = counts['success'] + counts['failed']
+        elapsed = time.perf_counter() - started
+        rate = finished / elapsed if elapsed else 0.0
+        remaining = total - finished - counts['skipped']
+        eta = f", eta {remaining / rate:.0f}s" if rate and not final else ''
+        print(
+            f"{'done' if final else 'progress'}: {finished + counts['skipped']}/{total} "
+            f"(rendered {counts['success']}, failed {counts['failed']}, skipped {counts['skipped']}) "
+            f"in {elapsed:.1f}s, {rate:.1f} docs/s{eta}",
+            file=sys.stderr, flush=True
+        )
+    
+    pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_batch_worker,
+        max_tasks_per_child=BATCH_MAX_TASKS_PER_CHILD or None,
+    )
+    pending = {}
+    remaining = read_corpus(args.input)
+    with pool, open(failures_path, 'w', encoding='utf-8') as failures:
+        def record_failure(index, error, invoice_number=None):
+            counts['failed'] += 1
+            failures.write(json.dumps({'line': index + 1, 'invoice_number': invoice_number, 'error': error}) + '\n')
+        
+        while True:
+            # Keep a few items queued per worker; the corpus is never loaded whole
+            for index, item in remaining:
+                if isinstance(item, Exception):
+                    record_failure(index, f'Invalid JSON: {item}')
+                    continue
+                path = os.path.join(args.outdir, archive_entry_name(index, item, args.format))
+                if not args.force and os.path.exists(path):
+                    counts['skipped'] += 1
+                    continue
+                pending[pool.submit(render_item_to_file, item, args.format, path)] = index
+                if len(pending) >= args.workers * 4:
+                    break
+            if not pending:
+                break
+            
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    print("Render pool crashed; rerun to resume from the last written document", file=sys.stderr)
+                    report(final=True)
+                    return 1
+                if result['status'] == 'success':
+                    counts['success'] += 1
+                else:
+                    record_failure(index, result['error'], result['invoice_number'])
+            
+            if time.perf_counter() - last_report >= args.progress_interval:
+                last_report = time.perf_counter()
+                report()
     
-    return jsonify(schema)
+    report(final=True)
+    if counts['failed']:
+        print(f"Failures listed in {failures_path}", file=sys.stderr)
+        return 1
+    return 0
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'render-batch':
+        logging.getLogger().setLevel(logging.WARNING)
+        sys.exit(render_batch_cli(sys.argv[2:]))
     logger.info("Starting Flask application with WeasyPrint PDF engine...")
+    warm_up()
     app.run(debug=True, host='0.0.0.0', port=8088)
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""Time PDF renders of large invoices as one giant table vs paginated table fragments
+
+Usage: python benchmarks/bench_pagination.py [--sizes 100 1000 5000] [--repeat 3]
+"""
+import argparse
+import copy
+import statistics
+
+from common import make_invoice, quiet_app_logging, time_call
+from app import InvoiceGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000], help='product row counts')
+    parser.add_argument('--repeat', type=int, default=3, help='renders per size and mode')
+    parser.add_argument('--rows-per-page', type=int, default=30, help='rows per fragment in paginated mode')
+    args = parser.parse_args()
+    quiet_app_logging()
+
+    generator = InvoiceGenerator()
+    # Warm the stylesheet and fonts so the first measurement is not penalised
+    generator.generate_pdf(make_invoice(5))
+
+    print(f"{'rows':>6} {'single table':>14} {'paginated':>12} {'speedup':>8}")
+    for size in args.sizes:
+        invoice = make_invoice(size)
+        paginated = dict(invoice, paginate=True, rows_per_page=args.rows_per_page)
+        single = statistics.median(time_call(lambda: generator.generate_pdf(copy.deepcopy(invoice)), args.repeat))
+        paged = statistics.median(time_call(lambda: generator.generate_pdf(copy.deepcopy(paginated)), args.repeat))
+        print(f"{size:>6} {single:>13.2f}s {paged:>11.2f}s {single / paged:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Compare PDF size against render time for each PDF profile on typical invoices
+
+Each invoice carries a photographic company logo, since image options are where
+the profiles differ most; pass --no-logo to measure text-only invoices.
+
+Usage: python benchmarks/bench_pdf_size.py [--sizes 10 50 200] [--repeat 5] [--no-logo]
+"""
+import argparse
+import atexit
+import copy
+import os
+import shutil
+import statistics
+import tempfile
+
+from common import make_invoice, quiet_app_logging, time_call
+
+# Always use a throwaway asset store, even when ASSET_DIR points at a live one
+os.environ['ASSET_DIR'] = tempfile.mkdtemp(prefix='bench-assets-')
+atexit.register(shutil.rmtree, os.environ['ASSET_DIR'], ignore_errors=True)
+
+from PIL import Image
+from app import PDF_PROFILES, InvoiceGenerator, asset_store
+
+LOGO_NAME = 'bench-logo.jpg'
+
+
+def ensure_logo():
+    """Upload a noisy 1600x800 JPEG so image optimisation has something to work on"""
+    image = Image.effect_noise((1600, 800), 48).convert('RGB')
+    path = asset_store.path(LOGO_NAME)
+    if not os.path.exists(path):
+        image.save(path, format='JPEG', quality=95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200], help='product row counts')
+    parser.add_argument('--repeat', type=int, default=5, help='renders per size and profile')
+    parser.add_argument('--no-logo', action='store_true', help='render invoices without a company logo')
+    args = parser.parse_args()
+    quiet_app_logging()
+
+    if not args.no_logo:
+        ensure_logo()
+    generator = InvoiceGenerator()
+    # Warm the stylesheet and fonts so the first measurement is not penalised
+    generator.generate_pdf(make_invoice(5))
+
+    print(f"{'rows':>6} {'profile':>10} {'median':>9} {'bytes':>10} {'vs standard':>12}")
+    for size in args.sizes:
+        invoice = make_invoice(size)
+        if not args.no_logo:
+            invoice['company_logo'] = LOGO_NAME
+        standard_bytes = None
+        for profile in PDF_PROFILES:
+            payload = dict(invoice, pdf_profile=profile)
+            pdf_bytes = generator.generate_pdf(copy.deepcopy(payload))
+            median = statistics.median(time_call(lambda: generator.generate_pdf(copy.deepcopy(payload)), args.repeat))
+            standard_bytes = standard_bytes or len(pdf_bytes)
+            print(f"{size:>6} {profile:>10} {median * 1000:>7.1f}ms {len(pdf_bytes):>10} {len(pdf_bytes) / standard_bytes:>11.0%}")
+
+
+if __name__ == '__main__':
+    main()
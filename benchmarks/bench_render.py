@@ -0,0 +1,153 @@
+"""Benchmark the HTML, QR and PDF render stages across invoice sizes and compare to a baseline
+
+Each (variant, size) case runs in a fresh process and reports how far peak RSS grew past
+the warmed-up process, so import and warm-up memory do not mask the case's own cost.
+
+Runs compare against benchmarks/baseline.json by default, checking only the cases and metrics
+it records. The committed file pins output bytes and RSS growth for the HTML and QR stages;
+re-save it on the reference host to add PDF cases and timings, which only compare between runs
+on the same machine.
+
+Usage:
+    python benchmarks/bench_render.py                          # exit 1 on regressions against baseline.json
+    python benchmarks/bench_render.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_render.py --baseline other.json
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import resource
+import sys
+
+from common import make_invoice, quiet_app_logging, time_call
+
+SIZES = [10, 100, 1000, 5000]
+VARIANTS = {
+    'plain': {},
+    'einvoice': {'einvoice': True},
+    'ewaybill': {'ewaybill': True},
+    'einvoice+ewaybill': {'einvoice': True, 'ewaybill': True},
+}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Growth below these floors is run-to-run noise, whatever the percentage
+MIN_CHANGE = {'p50_ms': 1.0, 'rss_growth_mb': 2.0, 'bytes': 0}
+
+
+def percentile(durations, pct):
+    """Nearest-rank percentile of a list of durations"""
+    ordered = sorted(durations)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(durations, output_bytes):
+    return {
+        'p50_ms': percentile(durations, 50) * 1000,
+        'p95_ms': percentile(durations, 95) * 1000,
+        'p99_ms': percentile(durations, 99) * 1000,
+        'bytes': output_bytes,
+    }
+
+
+def run_case(variant, size, repeat):
+    """Time every stage for one invoice shape; runs inside a fresh worker process"""
+    quiet_app_logging()
+    from app import InvoiceGenerator, build_qr_png_base64
+
+    generator = InvoiceGenerator()
+    invoice = make_invoice(size, **VARIANTS[variant])
+    # Warm the stylesheet and fonts outside the measurements
+    generator.generate_pdf(make_invoice(5))
+    # ru_maxrss is KiB on Linux
+    warm_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    stages = {}
+    html_content = generator.generate_html(copy.deepcopy(invoice), inline_css=False)
+    stages['html'] = summarize(
+        time_call(lambda: generator.generate_html(copy.deepcopy(invoice), inline_css=False), repeat),
+        len(html_content.encode())
+    )
+
+    if invoice.get('qr_code_data'):
+        def cold_qr():
+            build_qr_png_base64.cache_clear()
+            return generator.generate_qr_code(invoice['qr_code_data'])
+        stages['qr'] = summarize(time_call(cold_qr, repeat), len(cold_qr()))
+
+    pdf_bytes = generator.generate_pdf(copy.deepcopy(invoice))
+    stages['pdf'] = summarize(
+        time_call(lambda: generator.generate_pdf(copy.deepcopy(invoice)), repeat),
+        len(pdf_bytes)
+    )
+
+    rss_growth_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - warm_rss_kb) / 1024
+    return {f'{stage}/{variant}/{size}': dict(result, rss_growth_mb=rss_growth_mb) for stage, result in stages.items()}
+
+
+def compare(results, baseline, threshold):
+    """Return regression messages for cases whose p50, RSS growth or output size grew past the threshold"""
+    regressions = []
+    for key, result in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric, floor in MIN_CHANGE.items():
+            if metric not in previous:
+                continue
+            limit = max(previous[metric] * (1 + threshold), previous[metric] + floor)
+            if result[metric] > limit:
+                change = f"+{(result[metric] / previous[metric] - 1) * 100:.0f}%" if previous[metric] else 'new'
+                regressions.append(f"{key} {metric}: {previous[metric]:.1f} -> {result[metric]:.1f} ({change})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='product row counts')
+    parser.add_argument('--variants', nargs='+', choices=sorted(VARIANTS), default=list(VARIANTS))
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per stage')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against (default: %(default)s)')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed growth before flagging (0.10 = 10%%)')
+    parser.add_argument('--save-baseline', help='write results as a new baseline JSON')
+    args = parser.parse_args()
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for variant in args.variants:
+        for size in args.sizes:
+            with context.Pool(1) as pool:
+                results.update(pool.apply(run_case, (variant, size, args.repeat)))
+
+    print(f"{'case':<32} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'RSS +MB':>9} {'bytes':>10}")
+    for key, result in results.items():
+        print(f"{key:<32} {result['p50_ms']:>10.1f} {result['p95_ms']:>10.1f} {result['p99_ms']:>10.1f} "
+              f"{result['rss_growth_mb']:>9.1f} {result['bytes']:>10}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.save_baseline and os.path.abspath(args.save_baseline) == os.path.abspath(args.baseline):
+        return
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline {args.baseline} to create it")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    missing = sorted(set(results) - set(baseline))
+    if missing:
+        print(f"\nNot in baseline, so not checked: {', '.join(missing)}")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\nRegressions:")
+        for message in regressions:
+            print(f"  {message}")
+        sys.exit(1)
+    print("\nNo regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Measure cold-start cost: time to import the app and latency of the first PDF render
+
+Each run is a fresh interpreter, with and without the startup warm-up the servers run.
+
+Usage: python benchmarks/bench_startup.py [--repeat 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import copy, json, logging, time
+started = time.perf_counter()
+import app
+app.warm_up()
+imported = time.perf_counter()
+logging.getLogger('app').setLevel(logging.WARNING)
+app.invoice_generator.generate_pdf(copy.deepcopy(app.SAMPLE_INVOICE))
+print(json.dumps({'import_s': imported - started, 'first_render_s': time.perf_counter() - imported}))
+"""
+
+
+def run_probe(warm_up):
+    env = dict(os.environ, WARM_UP='true' if warm_up else 'false', LOG_LEVEL='WARNING')
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per mode')
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'startup s':>10} {'first render s':>16} {'total s':>10}")
+    for warm_up in (False, True):
+        runs = [run_probe(warm_up) for _ in range(args.repeat)]
+        imported = statistics.median(run['import_s'] for run in runs)
+        first = statistics.median(run['first_render_s'] for run in runs)
+        print(f"{'warm' if warm_up else 'cold':<10} {imported:>10.2f} {first:>16.3f} {imported + first:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
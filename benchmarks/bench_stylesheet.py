@@ -0,0 +1,48 @@
+"""Compare per-invoice PDF render time with an inline <style> block vs the precompiled stylesheet
+
+Usage: python benchmarks/bench_stylesheet.py [--products 20] [--repeat 20]
+"""
+import argparse
+import copy
+import statistics
+
+import weasyprint
+
+from common import make_invoice, quiet_app_logging, time_call
+from app import InvoiceGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=20, help='product rows per invoice')
+    parser.add_argument('--repeat', type=int, default=20, help='renders per variant')
+    args = parser.parse_args()
+    quiet_app_logging()
+
+    generator = InvoiceGenerator()
+    invoice = make_invoice(args.products)
+
+    def inline_render():
+        # The pre-split pipeline: CSS parsed and fonts configured on every render
+        html_content = generator.generate_html(copy.deepcopy(invoice), inline_css=True)
+        weasyprint.HTML(string=html_content).write_pdf()
+
+    def precompiled_render():
+        generator.generate_pdf(copy.deepcopy(invoice))
+
+    # Warm both paths so one-off font discovery does not skew the first variant
+    inline_render()
+    precompiled_render()
+
+    results = {}
+    for name, func in (('inline <style>', inline_render), ('precompiled CSS', precompiled_render)):
+        results[name] = statistics.median(time_call(func, args.repeat))
+        print(f"{name:>16}: median {results[name] * 1000:8.1f} ms per invoice")
+
+    saved = results['inline <style>'] - results['precompiled CSS']
+    print(f"{'saved':>16}: {saved * 1000:8.1f} ms per invoice "
+          f"({saved / results['inline <style>'] * 100:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Shared helpers for the rendering benchmarks"""
+import logging
+import os
+import sys
+import time
+
+# Make app.py importable when running `python benchmarks/<script>.py` from the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_product(serial_no):
+    """Build one realistic product row"""
+    return {
+        'serial_no': serial_no,
+        'hsn_code': '1905' + str(serial_no % 100).zfill(2),
+        'product_name': f'Biscuit Assorted Pack {serial_no} 200g',
+        'mrp': '40.00',
+        'cs': '1',
+        'qty': '24',
+        'free': '0',
+        'upc': '24',
+        'gross_rate': '32.14',
+        'total': '771.36',
+        'pri_disc': '7.71',
+        'sec_disc': '0.00',
+        'lnd_disc': '0.00',
+        'taxable_amt': '763.65',
+        'cgst_rate': '9.00',
+        'cgst_amt': '68.73',
+        'sgst_rate': '9.00',
+        'sgst_amt': '68.73',
+        'net_rate': '37.55',
+        'net_value': '901.11'
+    }
+
+
+def make_invoice(product_count, einvoice=False, ewaybill=False):
+    """Build a synthetic invoice payload with the given number of product rows"""
+    data = {
+        'invoice_number': f'BENCH{product_count:05d}',
+        'invoice_date': '01/01/2025',
+        'company_name': 'Benchmark Distributors Pvt Ltd',
+        'company_address': '12 Industrial Estate, Phase 2',
+        'company_city': 'Bengaluru',
+        'company_gstin': '29ABCDE1234F1Z5',
+        'customer_name': 'Corner Store',
+        'customer_address': '4 Market Road',
+        'products': [make_product(i + 1) for i in range(product_count)],
+        'total_items': str(product_count),
+        'grand_total': '901.11',
+        'net_receivable': '901.00',
+        'amount_in_words': 'Nine Hundred One Rupees Only',
+        'tax_slabs': [{
+            'taxable_amount': '763.65', 'cgst_rate': '9.00', 'cgst_amount': '68.73',
+            'sgst_rate': '9.00', 'sgst_amount': '68.73'
+        }],
+        'jurisdiction': 'Bengaluru'
+    }
+    if einvoice:
+        data.update({
+            'is_einvoice': True,
+            'irn_number': 'a5c12dca80e743321740b001fd70953e8738d109865d28ba4013750f2046f229',
+            'ack_no': '112010036563310',
+            'ack_date': '01/01/2025 10:00',
+            'einvoice_status': 'GENERATED',
+            'show_qr_code': True,
+            'qr_code_data': 'eyJhbGciOiJSUzI1NiIsImtpZCI6IkVEQzU3REUxMzU4QjMwMEJBOUY3OTM0MEE2Njk2ODMxRjNDODUwNDciLCJ0eXAiOiJKV1QifQ'
+        })
+    if ewaybill:
+        data.update({
+            'is_ewaybill': True,
+            'ewb_number': '331001234567',
+            'ewb_date': '01/01/2025',
+            'ewb_valid_until': '03/01/2025',
+            'ewaybill_status': 'GENERATED',
+            'transporter_name': 'Fast Movers',
+            'vehicle_number': 'KA01AB1234',
+            'from_place': 'Bengaluru',
+            'from_pincode': '560001',
+            'to_place': 'Mysuru',
+            'to_pincode': '570001',
+            'transport_distance': '145',
+            'transport_mode': 'Road'
+        })
+    return data
+
+
+def time_call(func, repeat):
+    """Call func repeat times and return the list of durations in seconds"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def quiet_app_logging():
+    """Silence the service's per-render INFO logging so it does not skew timings"""
+    logging.getLogger('app').setLevel(logging.WARNING)
@@ -0,0 +1,57 @@
+# Gunicorn configuration: gunicorn -c gunicorn.conf.py app:app
+import os
+import shutil
+import sys
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+timeout = 120
+
+# One worker by default, so a small (512 MB) instance holds a single copy of the rendering
+# stack; its threads keep a long batch request from holding the only thread, and the batch
+# pool does the parallel rendering. Exported so app.py can split the host's CPUs and memory
+# between the workers when WEB_CONCURRENCY is raised on bigger hosts
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# Import and warm up the app once in the master, then fork workers that share
+# the loaded fonts, compiled template and stylesheet copy-on-write
+preload_app = os.getenv('PRELOAD_APP', 'true').lower() in ('1', 'true', 'yes')
+
+# Shared with app.py so /metrics can aggregate every worker's samples. Cleared here,
+# before the preloaded app is imported, so each deployment starts with empty metric files
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'invoice-service-metrics')
+)
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    # Only the preloaded master has the app imported; never import it here otherwise
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        # Drop render slots left behind by the previous deployment's workers
+        app_module.render_scheduler.purge()
+        app_module.warm_up()
+        server.log.info("Invoice service ready: %s", app_module.STARTUP_TIMINGS)
+
+
+def post_worker_init(worker):
+    # Without preload_app every worker imported the app itself and warms up its own copy
+    if not worker.cfg.preload_app:
+        sys.modules['app'].warm_up()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_request(worker, req, environ, resp):
+    # Retire a worker whose RSS passed MEMORY_CEILING_MB once it has answered; the
+    # arbiter starts a fresh one from the preloaded master
+    app_module = sys.modules.get('app')
+    if app_module is not None and app_module.memory_governor.recycle_requested:
+        worker.log.info("Recycling worker %s after memory ceiling was reached", worker.pid)
+        worker.alive = False
@@ -0,0 +1,69 @@
+import copy
+
+import pytest
+
+try:
+    import weasyprint  # noqa: F401
+except (ImportError, OSError):
+    # WeasyPrint needs Pango and friends from the system to lay out pages
+    pytest.skip('WeasyPrint with its system libraries is required', allow_module_level=True)
+
+import app
+
+
+def paginated_invoice(product_count):
+    """Sample e-invoice (QR code and all) with product_count products, split into pages"""
+    data = copy.deepcopy(app.SAMPLE_INVOICE)
+    product = data['products'][0]
+    data['products'] = [
+        dict(product, serial_no=number, product_name=f'{product["product_name"]} {number}')
+        for number in range(1, product_count + 1)
+    ]
+    data.update(
+        paginate=True, is_einvoice=True, show_qr_code=True, einvoice_status='GENERATED',
+        irn_number='a' * 64, ack_no='112410000000001', ack_date='01/04/2024',
+        qr_code_data='signed-qr-payload', government_portal='einvoice1.gst.gov.in',
+        einvoice_compliance_note='Generated under Rule 48(4) of CGST Rules',
+    )
+    return data
+
+
+def product_table_pages(document):
+    """Return the (page number, table) pairs on which product table fragments were laid out"""
+    placed = set()
+    for number, page in enumerate(document.pages):
+        boxes = [page._page_box]
+        while boxes:
+            box = boxes.pop()
+            element = getattr(box, 'element', None)
+            if getattr(box, 'element_tag', None) == 'table' and 'products-table' in (element.get('class') or ''):
+                placed.add((number, id(element)))
+            boxes.extend(getattr(box, 'children', ()))
+    return placed
+
+
+@pytest.mark.parametrize('product_count', [
+    app.FIRST_PAGE_ROWS,
+    app.FIRST_PAGE_ROWS + app.ROWS_PER_PAGE + 5,
+    app.FIRST_PAGE_ROWS + 2 * app.ROWS_PER_PAGE + 5,
+])
+def test_each_subtotal_block_fills_exactly_one_page(product_count):
+    pipeline = app.RenderPipeline(app.invoice_generator, paginated_invoice(product_count), kind='invoice')
+    pipeline.validate()
+    document = pipeline.document()
+    blocks = pipeline.data['product_pages']
+
+    # A fragment spilling onto the next page would show up on two pages
+    placed = product_table_pages(document)
+    assert len(placed) == len(blocks)
+    assert len({number for number, _ in placed}) == len(blocks)
+    assert len(document.pages) == len(blocks)
+
+
+def test_first_page_holds_fewer_rows_than_later_pages():
+    pages = app.paginate_products(paginated_invoice(50)['products'], rows_per_page=30, first_page_rows=15)
+
+    assert [len(page['products']) for page in pages] == [15, 30, 5]
+    assert pages[0]['brought_forward'] is None
+    assert pages[1]['brought_forward'] == pages[0]['carried_forward']
+    assert pages[2]['carried_forward'] is None
@@ -0,0 +1,85 @@
+import copy
+from decimal import Decimal
+
+import pytest
+
+try:
+    import weasyprint  # noqa: F401
+except (ImportError, OSError):
+    # app imports WeasyPrint, which needs Pango and friends from the system
+    pytest.skip('WeasyPrint with its system libraries is required', allow_module_level=True)
+
+import app
+
+
+def invoice(products, **fields):
+    """Minimal compute_totals invoice with the given raw product rows"""
+    return dict(fields, compute_totals=True, products=[dict(product) for product in products])
+
+
+@pytest.mark.parametrize('amount, words', [
+    ('0', 'Zero Rupees Only'),
+    ('0.005', 'Zero Rupees and One Paise Only'),
+    ('7', 'Seven Rupees Only'),
+    ('1002.50', 'One Thousand Two Rupees and Fifty Paise Only'),
+    ('100000', 'One Lakh Rupees Only'),
+    ('12345678', 'One Crore Twenty Three Lakh Forty Five Thousand Six Hundred Seventy Eight Rupees Only'),
+    ('-30', 'Minus Thirty Rupees Only'),
+    ('-0.75', 'Minus Zero Rupees and Seventy Five Paise Only'),
+])
+def test_amount_in_words(amount, words):
+    assert app.amount_in_words(Decimal(amount)) == words
+
+
+@pytest.mark.parametrize('products, fields, expected', [
+    # 3 x 33.33 = 99.99; 9% of it is 8.9991, which rounds to 9.00 on each side
+    ([{'qty': '3', 'gross_rate': '33.33', 'cgst_rate': '9', 'sgst_rate': '9'}], {},
+     {'grand_total': '117.99', 'round_off': '0.01', 'net_receivable': '118.00'}),
+    # Discounts come off before tax; 2.5% of 95.00 is 2.375, rounded half-up to 2.38
+    ([{'qty': '1', 'gross_rate': '100', 'pri_disc': '5', 'cgst_rate': '2.5', 'sgst_rate': '2.5'}], {},
+     {'total_taxable_amt': '95.00', 'total_cgst': '2.38', 'grand_total': '99.76', 'net_receivable': '100.00'}),
+    # TCS is added and the credit adjustment taken off before rounding to the rupee
+    ([{'qty': '2', 'gross_rate': '10.25', 'cgst_rate': '0', 'sgst_rate': '0'}], {'tcs_tax_amt': '0.10', 'credit_adj': '1'},
+     {'grand_total': '20.50', 'round_off': '0.40', 'net_receivable': '20.00'}),
+    # Exactly half a rupee rounds up
+    ([{'qty': '1', 'gross_rate': '10.50', 'cgst_rate': '0', 'sgst_rate': '0'}], {},
+     {'round_off': '0.50', 'net_receivable': '11.00', 'amount_in_words': 'Eleven Rupees Only'}),
+    # A credit larger than the invoice leaves a negative amount, spelt with its sign
+    ([{'qty': '1', 'gross_rate': '20', 'cgst_rate': '0', 'sgst_rate': '0'}], {'credit_adj': '50'},
+     {'net_receivable': '-30.00', 'amount_in_words': 'Minus Thirty Rupees Only'}),
+])
+def test_compute_invoice_totals(products, fields, expected):
+    totals = app.compute_invoice_totals(invoice(products, **fields))
+    assert {key: totals[key] for key in expected} == expected
+
+
+def test_tax_slabs_group_lines_by_rate_pair():
+    totals = app.compute_invoice_totals(invoice([
+        {'qty': '1', 'gross_rate': '100', 'cgst_rate': '9', 'sgst_rate': '9'},
+        {'qty': '1', 'gross_rate': '50', 'cgst_rate': '2.5', 'sgst_rate': '2.5'},
+        {'qty': '2', 'gross_rate': '50', 'cgst_rate': '9', 'sgst_rate': '9'},
+    ]))
+    assert [(slab['cgst_rate'], slab['taxable_amount'], slab['cgst_amount']) for slab in totals['tax_slabs']] == [
+        ('2.50', '50.00', '1.25'),
+        ('9.00', '200.00', '18.00'),
+    ]
+
+
+@pytest.mark.parametrize('product, fields, message', [
+    ({'qty': '1e30'}, {}, 'products[0].qty: expected at most'),
+    ({'gross_rate': '-2000000000'}, {}, 'products[0].gross_rate: expected at most'),
+    ({'cgst_rate': '150'}, {}, 'products[0].cgst_rate: expected a rate between 0 and 100'),
+    ({}, {'credit_adj': '1e12'}, 'credit_adj: expected at most'),
+])
+def test_out_of_range_totals_inputs_are_rejected(product, fields, message):
+    data = invoice([dict({'qty': '1', 'gross_rate': '10', 'cgst_rate': '9', 'sgst_rate': '9'}, **product)], **fields)
+    assert any(error.startswith(message) for error in app.totals_input_errors(data))
+
+
+def test_huge_quantity_gets_a_400():
+    data = copy.deepcopy(app.SAMPLE_INVOICE)
+    data.update(compute_totals=True)
+    data['products'][0].update(qty=1e30, gross_rate='10')
+    response = app.app.test_client().post('/generate-invoice', json=data)
+    assert response.status_code == 400
+    assert 'products[0].qty' in response.get_json()['error']
@@ -0,0 +1,60 @@
+import copy
+
+import pytest
+
+try:
+    import weasyprint  # noqa: F401
+except (ImportError, OSError):
+    # app imports WeasyPrint, which needs Pango and friends from the system
+    pytest.skip('WeasyPrint with its system libraries is required', allow_module_level=True)
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('value', ['inf', '-Infinity', 'nan', '1e999', float('inf'), float('nan'), True, 'ten'])
+def test_coerce_number_rejects_non_finite_and_non_numeric_values(value):
+    with pytest.raises(TypeError):
+        app.coerce_number(value)
+
+
+@pytest.mark.parametrize('value, expected', [('12', 12), (' 1.5 ', 1.5), (7, 7), (10 ** 400, 10 ** 400)])
+def test_coerce_number_accepts_finite_numbers(value, expected):
+    assert app.coerce_number(value) == expected
+
+
+@pytest.mark.parametrize('value', [0, -3, '2.5', 'inf', 'nan', '0'])
+def test_coerce_count_rejects_anything_but_positive_whole_numbers(value):
+    with pytest.raises(TypeError):
+        app.coerce_count(value)
+
+
+@pytest.mark.parametrize('value, expected', [('30', 30), (15.0, 15), (1, 1)])
+def test_coerce_count_returns_ints(value, expected):
+    assert app.coerce_count(value) == expected
+
+
+@pytest.mark.parametrize('rows_per_page', ['inf', 'nan', '1e999', 0, '-5'])
+def test_invalid_rows_per_page_is_a_validation_error(rows_per_page):
+    data = dict(copy.deepcopy(app.SAMPLE_INVOICE), paginate=True, rows_per_page=rows_per_page)
+    with pytest.raises(app.ValidationError) as excinfo:
+        app.RenderPipeline(app.invoice_generator, data, kind='invoice').validate()
+    assert any(error.startswith('rows_per_page:') for error in excinfo.value.errors)
+
+
+def test_invalid_rows_per_page_gets_a_400(client):
+    data = dict(copy.deepcopy(app.SAMPLE_INVOICE), paginate=True, rows_per_page='inf')
+    response = client.post('/generate-invoice', json=data)
+    assert response.status_code == 400
+    assert 'rows_per_page' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('path', ['/generate-invoice', '/generate-ewaybill'])
+def test_payload_that_is_not_an_object_gets_a_400(client, path):
+    response = client.post(path, json=[copy.deepcopy(app.SAMPLE_INVOICE)])
+    assert response.status_code == 400
+    assert response.get_json()['details'] == ['Payload must be a JSON object']